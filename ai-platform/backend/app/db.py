@@ -26,13 +26,21 @@ def is_enabled() -> bool:
     return _pool is not None
 
 
-async def init_db(database_url: str) -> None:
+async def init_db(database_url: str, *, statement_cache_size: int = 1024) -> None:
     global _pool
 
     if _pool is not None:
         return
 
-    _pool = await asyncpg.create_pool(dsn=database_url, min_size=1, max_size=5)
+    # asyncpg prepares every query and keeps it in a per-connection LRU. The default of
+    # 100 entries is smaller than the set of query shapes here (update_task_row alone
+    # builds one per field combination), so hot reads would keep getting re-parsed.
+    _pool = await asyncpg.create_pool(
+        dsn=database_url,
+        min_size=1,
+        max_size=5,
+        statement_cache_size=statement_cache_size,
+    )
     async with _pool.acquire() as conn:
         await conn.execute(
             """
@@ -678,6 +686,63 @@ async def append_event(task_id: str, type: str, payload: Optional[Dict[str, Any]
         raise
 
 
+async def append_events_bulk(
+    events: List[Tuple[str, str, Optional[Dict[str, Any]], datetime]],
+) -> None:
+    """Insert (task_id, type, payload, created_at) events with a single COPY.
+
+    COPY is all-or-nothing, so on failure the rows are re-inserted one at a
+    time and only the rows that fail on their own are dropped.
+    """
+    if _pool is None:
+        logger.debug("Database not enabled; skipping append_events_bulk for %s events", len(events))
+        return
+    if not events:
+        return
+
+    records = [
+        (uuid.uuid4(), task_id, event_type, _json_payload(payload), created_at)
+        for task_id, event_type, payload, created_at in events
+    ]
+    try:
+        await _pool.copy_records_to_table(
+            "task_events",
+            columns=["id", "task_id", "type", "payload_json", "created_at"],
+            records=[
+                (event_id, _coerce_task_id(task_id), event_type, payload_json, created_at)
+                for event_id, task_id, event_type, payload_json, created_at in records
+            ],
+        )
+        return
+    except Exception:
+        _log_db_error(
+            "append_events_bulk",
+            {"events": len(events), "task_ids": sorted({event[0] for event in events})},
+        )
+
+    failed = 0
+    last_error: Optional[Exception] = None
+    for event_id, task_id, event_type, payload_json, created_at in records:
+        try:
+            await _pool.execute(
+                """
+                INSERT INTO task_events (id, task_id, type, payload_json, created_at)
+                VALUES ($1, $2, $3, $4::jsonb, $5);
+                """,
+                event_id,
+                _coerce_task_id(task_id),
+                event_type,
+                payload_json,
+                created_at,
+            )
+        except Exception as exc:
+            failed += 1
+            last_error = exc
+            _log_db_error("append_events_bulk", {"task_id": task_id, "type": event_type})
+    if last_error is not None and failed == len(records):
+        raise last_error
+
+
 async def add_artifact(
     task_id: str,
     type: str,
@@ -896,6 +961,90 @@ async def upsert_task_file(
         raise
 
 
+async def bulk_upsert_task_files(
+    task_id: str,
+    rows: List[Dict[str, Any]],
+    *,
+    max_bytes: Optional[int] = None,
+    max_files: Optional[int] = None,
+) -> None:
+    """Upsert many task files in one transaction; limits are checked for the batch as a whole."""
+    if _pool is None:
+        logger.debug("Database not enabled; skipping bulk_upsert_task_files for task %s", task_id)
+        return
+    if not rows:
+        return
+
+    task_uuid = _coerce_task_id(task_id)
+    try:
+        async with _pool.acquire() as conn:
+            async with conn.transaction():
+                existing_rows = await conn.fetch(
+                    """
+                    SELECT path, size_bytes
+                    FROM task_files
+                    WHERE task_id = $1;
+                    """,
+                    task_uuid,
+                )
+                sizes = {row["path"]: int(row["size_bytes"]) for row in existing_rows}
+                for row in rows:
+                    sizes[row["path"]] = row["size_bytes"]
+                new_count = len(sizes)
+                new_total = sum(sizes.values())
+
+                if max_files is not None and max_files > 0 and new_count > max_files:
+                    raise ValueError(
+                        f"Task file count limit exceeded ({new_count} > {max_files})"
+                    )
+                if max_bytes is not None and max_bytes > 0 and new_total > max_bytes:
+                    raise ValueError(
+                        f"Task storage limit exceeded ({new_total} > {max_bytes} bytes)"
+                    )
+
+                await conn.executemany(
+                    """
+                    INSERT INTO task_files (
+                        task_id,
+                        path,
+                        content,
+                        content_bytes,
+                        mime_type,
+                        sha256,
+                        size_bytes,
+                        updated_at
+                    )
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, NOW())
+                    ON CONFLICT (task_id, path)
+                    DO UPDATE SET
+                        content = EXCLUDED.content,
+                        content_bytes = EXCLUDED.content_bytes,
+                        mime_type = EXCLUDED.mime_type,
+                        sha256 = EXCLUDED.sha256,
+                        size_bytes = EXCLUDED.size_bytes,
+                        updated_at = NOW();
+                    """,
+                    [
+                        (
+                            task_uuid,
+                            row["path"],
+                            row["content"],
+                            row["content_bytes"],
+                            row["mime_type"],
+                            row["sha256"],
+                            row["size_bytes"],
+                        )
+                        for row in rows
+                    ],
+                )
+    except Exception:
+        _log_db_error(
+            "bulk_upsert_task_files",
+            {"task_id": task_id, "files": len(rows)},
+        )
+        raise
+
+
 async def delete_task_file(task_id: str, path: str) -> None:
     if _pool is None:
         logger.debug("Database not enabled; skipping delete_task_file for task %s", task_id)
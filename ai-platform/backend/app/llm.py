@@ -3,23 +3,81 @@
 from __future__ import annotations
 
 import asyncio
-import json
+import bisect
+import hashlib
 import logging
 import os
+import random
+import re
+import sys
+import time
+from collections import OrderedDict, deque
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Protocol
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    List,
+    Literal,
+    Mapping,
+    NamedTuple,
+    NoReturn,
+    Optional,
+    Protocol,
+    Set,
+    Tuple,
+    Union,
+)
 
 import httpx
+import numpy as np
+import orjson
+from pydantic import BaseModel, field_validator
 
 logger = logging.getLogger(__name__)
 
+__all__ = [
+    "BinnedDispatcher",
+    "ChunkPayload",
+    "ConcurrencyLimiter",
+    "LLMInvalidResponseError",
+    "LLMOutputTruncatedError",
+    "LLMProvider",
+    "LLMProviderError",
+    "LLMSettings",
+    "MockProvider",
+    "OpenAIProvider",
+    "ResultCache",
+    "SemanticCache",
+    "TokenBucket",
+    "Usage",
+    "close_http_clients",
+    "generate_batch",
+    "generate_many",
+    "generate_text_chunks_json",
+    "generate_with_retry",
+    "get_llm_provider",
+    "load_llm_settings",
+    "reload_llm_settings",
+]
+
 
 class LLMProviderError(RuntimeError):
     """Error raised when an LLM provider request fails."""
 
-    def __init__(self, message: str, *, retryable: bool = False):
+    def __init__(
+        self,
+        message: str,
+        *,
+        retryable: bool = False,
+        retry_after: Optional[float] = None,
+    ):
         super().__init__(message)
         self.retryable = retryable
+        self.retry_after = retry_after
 
 
 class LLMOutputTruncatedError(RuntimeError):
@@ -52,6 +110,41 @@ class LLMInvalidResponseError(RuntimeError):
         self.usage = usage or {}
 
 
+class Usage(NamedTuple):
+    """Token usage counters accumulated across provider calls."""
+
+    input_tokens: int = 0
+    output_tokens: int = 0
+    total_tokens: int = 0
+
+    @classmethod
+    def from_mapping(cls, usage: Mapping[str, Any]) -> "Usage":
+        input_tokens = int(usage.get("input_tokens") or 0)
+        output_tokens = int(usage.get("output_tokens") or 0)
+        total_tokens = usage.get("total_tokens")
+        if total_tokens is None:
+            return cls(input_tokens, output_tokens, input_tokens + output_tokens)
+        return cls(input_tokens, output_tokens, int(total_tokens or 0))
+
+
+class ChunkPayload(BaseModel):
+    """Schema of a single chunk returned by the chunked JSON protocol."""
+
+    status: Literal["partial", "complete"]
+    # Left unvalidated: callers compare it with ==, so 1.0 matches 1 and it is ignored
+    # when no index is expected.
+    chunk_index: Any = None
+    content_chunk: str
+
+    @field_validator("content_chunk", mode="before")
+    @classmethod
+    def _stringify_content_chunk(cls, value: Any) -> Any:
+        # Models sometimes return numbers, booleans or lists here; keep them as text.
+        if value is None or isinstance(value, str):
+            return value
+        return str(value)
+
+
 class LLMProvider(Protocol):
     name: str
 
@@ -79,20 +172,58 @@ class LLMSettings:
     chunking_enabled: bool
     max_chunks: int
     max_file_chars: int
+    cache_max_mb: float = 0.0
+    cache_ttl_seconds: float = 300.0
+    cache_max_entries: int = 1024
+    semantic_cache_threshold: float = 0.0
+    semantic_cache_max_entries: int = 512
+    embedding_model: str = "text-embedding-3-small"
+    max_concurrency: int = 16
+    requests_per_minute: int = 500
+    continuation_tail_chars: int = 2000
+
+
+_FALSY_ENV_VALUES = frozenset({"0", "false", "no", "off"})
+
 
+def _env_int(name: str, default: str) -> int:
+    raw = os.getenv(name, default)
+    try:
+        return int(raw)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer, got {raw!r}") from None
 
+
+def _env_float(name: str, default: str) -> float:
+    raw = os.getenv(name, default)
+    try:
+        return float(raw)
+    except ValueError:
+        raise ValueError(f"{name} must be a number, got {raw!r}") from None
+
+
+@lru_cache(maxsize=1)
 def load_llm_settings() -> LLMSettings:
     provider = os.getenv("LLM_PROVIDER", "mock").strip().lower()
     model = os.getenv("LLM_MODEL", "gpt-4o-mini").strip()
     api_key = os.getenv("LLM_API_KEY")
-    max_tokens = int(os.getenv("LLM_MAX_TOKENS", "1024"))
-    max_tokens_coder = int(os.getenv("LLM_MAX_TOKENS_CODER", str(max_tokens)))
-    timeout_seconds = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
-    temperature = float(os.getenv("LLM_TEMPERATURE", "0.2"))
+    max_tokens = _env_int("LLM_MAX_TOKENS", "1024")
+    max_tokens_coder = _env_int("LLM_MAX_TOKENS_CODER", str(max_tokens))
+    timeout_seconds = _env_float("LLM_TIMEOUT_SECONDS", "30")
+    temperature = _env_float("LLM_TEMPERATURE", "0.2")
     response_format = os.getenv("LLM_RESPONSE_FORMAT", "json_object").strip().lower()
     chunking_enabled = _parse_bool_env(os.getenv("LLM_CHUNKING_ENABLED", "1"))
-    max_chunks = int(os.getenv("LLM_MAX_CHUNKS", "8"))
-    max_file_chars = int(os.getenv("LLM_MAX_FILE_CHARS", "12000"))
+    max_chunks = _env_int("LLM_MAX_CHUNKS", "8")
+    max_file_chars = _env_int("LLM_MAX_FILE_CHARS", "12000")
+    cache_max_mb = _env_float("LLM_CACHE_MAX_MB", "0")
+    cache_ttl_seconds = _env_float("LLM_CACHE_TTL_SECONDS", "300")
+    cache_max_entries = _env_int("LLM_CACHE_MAX_ENTRIES", "1024")
+    semantic_cache_threshold = _env_float("LLM_SEMANTIC_CACHE_THRESHOLD", "0")
+    semantic_cache_max_entries = _env_int("LLM_SEMANTIC_CACHE_MAX_ENTRIES", "512")
+    embedding_model = os.getenv("LLM_EMBEDDING_MODEL", "text-embedding-3-small").strip()
+    max_concurrency = _env_int("LLM_MAX_CONCURRENCY", "16")
+    requests_per_minute = _env_int("LLM_RPM", "500")
+    continuation_tail_chars = _env_int("LLM_CONTINUATION_TAIL", "2000")
     return LLMSettings(
         provider=provider,
         model=model,
@@ -105,9 +236,377 @@ def load_llm_settings() -> LLMSettings:
         chunking_enabled=chunking_enabled,
         max_chunks=max_chunks,
         max_file_chars=max_file_chars,
+        cache_max_mb=cache_max_mb,
+        cache_ttl_seconds=cache_ttl_seconds,
+        cache_max_entries=cache_max_entries,
+        semantic_cache_threshold=semantic_cache_threshold,
+        semantic_cache_max_entries=semantic_cache_max_entries,
+        embedding_model=embedding_model,
+        max_concurrency=max_concurrency,
+        requests_per_minute=requests_per_minute,
+        continuation_tail_chars=continuation_tail_chars,
     )
 
 
+def reload_llm_settings() -> LLMSettings:
+    """Drop the cached settings and re-read them from the environment."""
+    load_llm_settings.cache_clear()
+    settings = load_llm_settings()
+    if _request_limits is not None:
+        _get_request_limits(settings.max_concurrency, settings.requests_per_minute)
+    return settings
+
+
+class ResultCache:
+    """In-memory LRU cache with TTL for deterministic LLM responses."""
+
+    def __init__(
+        self,
+        *,
+        max_size_mb: float,
+        ttl_seconds: float,
+        max_entries: int = 1024,
+    ) -> None:
+        self.max_size_mb = max_size_mb
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self._entries: "OrderedDict[str, Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+        self._size_bytes = 0
+
+    @staticmethod
+    def make_key(
+        provider_name: str,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        response_format: Optional[Dict[str, Any]],
+        max_tokens: int,
+    ) -> str:
+        payload = orjson.dumps(
+            [provider_name, model, messages, temperature, response_format, max_tokens],
+            option=orjson.OPT_SORT_KEYS,
+        )
+        return hashlib.blake2b(payload).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, _, value = entry
+        if expires_at <= time.monotonic():
+            self._evict(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        size = sys.getsizeof(orjson.dumps(value))
+        if size > self.max_size_bytes:
+            return
+        if key in self._entries:
+            self._evict(key)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, size, value)
+        self._size_bytes += size
+        while self._size_bytes > self.max_size_bytes or len(self._entries) > self.max_entries:
+            self._evict(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._size_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._size_bytes -= size
+
+
+_result_cache: Optional[ResultCache] = None
+
+
+def _get_result_cache(settings: LLMSettings) -> Optional[ResultCache]:
+    global _result_cache
+    if settings.cache_max_mb <= 0:
+        return None
+    if (
+        _result_cache is None
+        or _result_cache.max_size_mb != settings.cache_max_mb
+        or _result_cache.ttl_seconds != settings.cache_ttl_seconds
+        or _result_cache.max_entries != settings.cache_max_entries
+    ):
+        _result_cache = ResultCache(
+            max_size_mb=settings.cache_max_mb,
+            ttl_seconds=settings.cache_ttl_seconds,
+            max_entries=settings.cache_max_entries,
+        )
+    return _result_cache
+
+
+class SemanticCache:
+    """Similarity cache for near-duplicate prompts keyed by prompt embeddings.
+
+    Entries live in a fixed-size ring of unit vectors; a lookup is one matrix-vector
+    product restricted to entries that share the same namespace (provider, model,
+    preceding messages and token budget) and have not expired.
+    """
+
+    def __init__(self, *, threshold: float, max_entries: int, ttl_seconds: float) -> None:
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._vectors: Optional[np.ndarray] = None
+        self._namespaces = np.full(self.max_entries, "", dtype="<U32")
+        self._expires_at = np.zeros(self.max_entries, dtype=np.float64)
+        self._values: List[Optional[Dict[str, Any]]] = [None] * self.max_entries
+        self._next_slot = 0
+
+    @staticmethod
+    def make_namespace(
+        provider_name: str,
+        model: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+    ) -> str:
+        payload = orjson.dumps(
+            [provider_name, model, messages[:-1], max_tokens],
+            option=orjson.OPT_SORT_KEYS,
+        )
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    def lookup(self, namespace: str, embedding: List[float]) -> Optional[Dict[str, Any]]:
+        if self._vectors is None:
+            return None
+        query = _unit_vector(embedding)
+        if query.shape[0] != self._vectors.shape[1]:
+            return None
+        valid = (self._expires_at > time.monotonic()) & (self._namespaces == namespace)
+        if not valid.any():
+            return None
+        scores = np.where(valid, self._vectors @ query, -1.0)
+        best = int(scores.argmax())
+        if scores[best] < self.threshold:
+            return None
+        return self._values[best]
+
+    def store(self, namespace: str, embedding: List[float], value: Dict[str, Any]) -> None:
+        vector = _unit_vector(embedding)
+        if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+            self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            self._expires_at[:] = 0.0
+        slot = self._next_slot
+        self._vectors[slot] = vector
+        self._namespaces[slot] = namespace
+        self._expires_at[slot] = time.monotonic() + self.ttl_seconds
+        self._values[slot] = value
+        self._next_slot = (slot + 1) % self.max_entries
+
+
+def _unit_vector(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+_semantic_cache: Optional[SemanticCache] = None
+
+
+def _get_semantic_cache(settings: LLMSettings) -> Optional[SemanticCache]:
+    global _semantic_cache
+    if settings.semantic_cache_threshold <= 0:
+        return None
+    if (
+        _semantic_cache is None
+        or _semantic_cache.threshold != settings.semantic_cache_threshold
+        or _semantic_cache.max_entries != settings.semantic_cache_max_entries
+        or _semantic_cache.ttl_seconds != settings.cache_ttl_seconds
+    ):
+        _semantic_cache = SemanticCache(
+            threshold=settings.semantic_cache_threshold,
+            max_entries=settings.semantic_cache_max_entries,
+            ttl_seconds=settings.cache_ttl_seconds,
+        )
+    return _semantic_cache
+
+
+class TokenBucket:
+    """Monotonic-clock token bucket limiting requests per minute."""
+
+    def __init__(self, requests_per_minute: int) -> None:
+        self.capacity = float(max(0, requests_per_minute))
+        self.refill_per_second = self.capacity / 60.0
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.capacity <= 0:
+            # No rate limit, but a 429 cooldown still applies.
+            while (delay := self._paused_until - time.monotonic()) > 0:
+                await asyncio.sleep(delay)
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated_at) * self.refill_per_second,
+                )
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.refill_per_second)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back new requests, e.g. after the server answered 429."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def resize(self, requests_per_minute: int) -> None:
+        """Change the rate in place so callers already waiting keep sharing this bucket."""
+        capacity = float(max(0, requests_per_minute))
+        if capacity == self.capacity:
+            return
+        was_unlimited = self.capacity <= 0
+        self.capacity = capacity
+        self.refill_per_second = capacity / 60.0
+        self._tokens = capacity if was_unlimited else min(self._tokens, capacity)
+        self._updated_at = time.monotonic()
+
+
+class ConcurrencyLimiter:
+    """Async context manager like asyncio.Semaphore, but its limit can change in flight."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = max(1, limit)
+        self._in_use = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def __aenter__(self) -> "ConcurrencyLimiter":
+        while self._in_use >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # A woken waiter that got cancelled must pass its turn on
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self._in_use += 1
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self._in_use -= 1
+        self._wake()
+
+    def resize(self, limit: int) -> None:
+        self.limit = max(1, limit)
+        self._wake()
+
+    def _wake(self) -> None:
+        free = self.limit - self._in_use
+        for waiter in self._waiters:
+            if free <= 0:
+                break
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+# One limiter pair per process: after /admin/reload it is resized rather than replaced,
+# so calls already in flight still count against the new limits.
+_request_limits: Optional[Tuple[ConcurrencyLimiter, TokenBucket]] = None
+
+
+def _get_request_limits(
+    max_concurrency: int,
+    requests_per_minute: int,
+) -> Tuple[ConcurrencyLimiter, TokenBucket]:
+    global _request_limits
+    if _request_limits is None:
+        _request_limits = (ConcurrencyLimiter(max_concurrency), TokenBucket(requests_per_minute))
+    else:
+        semaphore, bucket = _request_limits
+        semaphore.resize(max_concurrency)
+        bucket.resize(requests_per_minute)
+    return _request_limits
+
+
+_http_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _classify_model(model: str) -> str:
+    normalized = model.lower()
+    if "mini" in normalized or "nano" in normalized:
+        return "fast"
+    return "slow"
+
+
+def _get_http_client(url: str, model: str) -> httpx.AsyncClient:
+    """Return the pooled client for the request host and model latency class.
+
+    Fast and slow models get separate keep-alive pools so long completions do not
+    hold connections that short ones are waiting for.
+    """
+    model_class = _classify_model(model)
+    key = f"{httpx.URL(url).host}|{model_class}"
+    client = _http_clients.get(key)
+    if client is None or client.is_closed:
+        keepalive = 20 if model_class == "slow" else 100
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=keepalive),
+            http2=True,
+        )
+        _http_clients[key] = client
+    return client
+
+
+async def close_http_clients() -> None:
+    clients = list(_http_clients.values())
+    _http_clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+_CHUNK_PROTOCOL_MARKERS = re.compile(r"content_chunk|chunk_index|status")
+_CHUNK_PROTOCOL_MARKER_BITS = {"content_chunk": 1, "chunk_index": 2, "status": 4}
+
+
+def _expects_chunk_protocol(prompt: str) -> bool:
+    seen = 0
+    for match in _CHUNK_PROTOCOL_MARKERS.finditer(prompt):
+        seen |= _CHUNK_PROTOCOL_MARKER_BITS[match.group()]
+        if seen == 7:
+            return True
+    return False
+
+
+_MOCK_CONTENT_TEMPLATE = '''"""
+Auto-generated mock implementation.
+"""
+
+# Task: {task}
+
+def placeholder():
+    """Mock implementation placeholder."""
+    return "mock-response"
+'''
+_MOCK_IMPLEMENTATION_PLAN = (
+    "1. Review task context and requirements.\n"
+    "2. Implement requested changes in the target file.\n"
+    "3. Validate output and update summaries."
+)
+
+
 class MockProvider:
     name = "mock"
 
@@ -120,53 +619,43 @@ class MockProvider:
         response_format: Optional[Dict[str, Any]] = None,
     ) -> Dict[str, Any]:
         prompt = messages[-1]["content"] if messages else ""
-        expects_chunk = all(
-            token in prompt for token in ("content_chunk", "chunk_index", "status")
-        )
+        expects_chunk = _expects_chunk_protocol(prompt)
         path = "generated.py"
         task_line = "Implement requested changes."
         exact_json_only = False
-        try:
-            payload = json.loads(prompt)
-            path = payload.get("Target file") or payload.get("Target file", path)
+        payload = None
+        # Most prompts are plain text; only pay for a parse attempt when it can be an object.
+        if prompt.lstrip().startswith("{"):
+            try:
+                payload = orjson.loads(prompt)
+            except orjson.JSONDecodeError:
+                payload = None
+        if isinstance(payload, dict):
+            path = payload.get("Target file") or path
             task_line = payload.get("Task", task_line)
             contract_payload = payload.get("Output contract") or {}
             if isinstance(contract_payload, dict):
                 exact_json_only = bool(contract_payload.get("exact_json_only"))
-        except json.JSONDecodeError:
+        else:
             path = _extract_between(prompt, "Target file:", "\n") or path
             task_line = _extract_between(prompt, "Task:", "\n") or task_line
-        content = f'''"""
-Auto-generated mock implementation.
-"""
-
-# Task: {task_line.strip()}
-
-def placeholder():
-    """Mock implementation placeholder."""
-    return "mock-response"
-'''
-        response = {
-            "files": [{"path": path.strip(), "content": content}],
-            "artifacts": {
-                "implementation_plan": (
-                    "1. Review task context and requirements.\n"
-                    "2. Implement requested changes in the target file.\n"
-                    "3. Validate output and update summaries."
-                )
-            },
-        }
-        if exact_json_only:
-            response = {"files": [{"path": path.strip(), "content": content}]}
+        content = _MOCK_CONTENT_TEMPLATE.format(task=task_line.strip())
         if expects_chunk:
-            response = {
+            response: Dict[str, Any] = {
                 "status": "complete",
                 "chunk_index": 1,
                 "content_chunk": content,
             }
-        text = json.dumps(response, ensure_ascii=False)
-        tokens_in = max(1, len(prompt.split()))
-        tokens_out = max(1, len(text.split()))
+        elif exact_json_only:
+            response = {"files": [{"path": path.strip(), "content": content}]}
+        else:
+            response = {
+                "files": [{"path": path.strip(), "content": content}],
+                "artifacts": {"implementation_plan": _MOCK_IMPLEMENTATION_PLAN},
+            }
+        text = orjson.dumps(response).decode("utf-8")
+        tokens_in = _estimate_tokens(prompt)
+        tokens_out = _estimate_tokens(text)
         return {
             "text": text,
             "usage": {
@@ -178,12 +667,29 @@ def placeholder():
         }
 
 
+_OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+_OPENAI_EMBEDDINGS_URL = "https://api.openai.com/v1/embeddings"
+
+
 class OpenAIProvider:
     name = "openai"
 
-    def __init__(self, api_key: str, timeout_seconds: float):
+    def __init__(
+        self,
+        api_key: str,
+        timeout_seconds: float,
+        *,
+        max_concurrency: int = 16,
+        requests_per_minute: int = 500,
+    ):
         self.api_key = api_key
         self.timeout_seconds = timeout_seconds
+        self._headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        }
+        self._timeout = httpx.Timeout(timeout_seconds)
+        self._semaphore, self._bucket = _get_request_limits(max_concurrency, requests_per_minute)
 
     async def generate_text(
         self,
@@ -193,61 +699,54 @@ class OpenAIProvider:
         max_tokens: int,
         response_format: Optional[Dict[str, Any]] = None,
     ) -> Dict[str, Any]:
-        url = "https://api.openai.com/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
+        url = _OPENAI_CHAT_URL
         payload = {
             "model": model,
             "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens,
+            "stream": True,
+            "stream_options": {"include_usage": True},
         }
         if response_format:
             payload["response_format"] = response_format
-        timeout = httpx.Timeout(self.timeout_seconds)
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            async def _post(request_payload: Dict[str, Any]) -> httpx.Response:
-                response = await client.post(url, headers=headers, json=request_payload)
-                response.raise_for_status()
-                return response
+        async with self._semaphore:
+            await self._bucket.acquire()
+            client = _get_http_client(url, model)
+
+            async def _post(request_payload: Dict[str, Any]) -> Dict[str, Any]:
+                started_at = time.monotonic()
+                async with client.stream(
+                    "POST",
+                    url,
+                    headers=self._headers,
+                    content=orjson.dumps(request_payload),
+                    timeout=self._timeout,
+                ) as response:
+                    if response.is_error:
+                        await response.aread()
+                    response.raise_for_status()
+                    return await _read_completion_stream(response, started_at)
 
             try:
-                response = await _post(payload)
+                data = await _post(payload)
             except httpx.HTTPStatusError as exc:
-                status = exc.response.status_code if exc.response else None
-                if response_format and status in {400, 404} and exc.response is not None:
-                    body = exc.response.text or ""
-                    if "response_format" in body or "json_object" in body:
-                        payload.pop("response_format", None)
-                        try:
-                            response = await _post(payload)
-                        except httpx.HTTPStatusError as fallback_exc:
-                            fallback_status = (
-                                fallback_exc.response.status_code if fallback_exc.response else None
-                            )
-                            retryable = fallback_status in {408, 429} or (
-                                fallback_status is not None and fallback_status >= 500
-                            )
-                            message = (
-                                "OpenAI API error "
-                                f"({fallback_status}): "
-                                f"{fallback_exc.response.text if fallback_exc.response else fallback_exc}"
-                            )
-                            raise LLMProviderError(message, retryable=retryable) from fallback_exc
-                    else:
-                        retryable = status in {408, 429} or (status is not None and status >= 500)
-                        message = f"OpenAI API error ({status}): {exc.response.text}"
-                        raise LLMProviderError(message, retryable=retryable) from exc
-                else:
-                    retryable = status in {408, 429} or (status is not None and status >= 500)
-                    message = f"OpenAI API error ({status}): {exc.response.text if exc.response else exc}"
-                    raise LLMProviderError(message, retryable=retryable) from exc
+                status = exc.response.status_code if exc.response is not None else None
+                body = exc.response.text if exc.response is not None else ""
+                if not (
+                    response_format
+                    and status in {400, 404}
+                    and ("response_format" in body or "json_object" in body)
+                ):
+                    self._raise_openai_error(exc)
+                payload.pop("response_format", None)
+                try:
+                    data = await _post(payload)
+                except httpx.HTTPStatusError as fallback_exc:
+                    self._raise_openai_error(fallback_exc)
             except (httpx.TimeoutException, httpx.TransportError) as exc:
                 raise LLMProviderError(f"OpenAI request failed: {exc}", retryable=True) from exc
 
-        data = response.json()
         choice = data.get("choices", [{}])[0]
         text = choice.get("message", {}).get("content", "")
         finish_reason = choice.get("finish_reason")
@@ -261,25 +760,140 @@ class OpenAIProvider:
         }
         logger.info(
             "OpenAI completion metrics prompt_chars=%s max_tokens=%s finish_reason=%s "
-            "response_chars=%s usage=%s",
+            "response_chars=%s first_token_ms=%s usage=%s",
             prompt_chars,
             max_tokens,
             finish_reason,
             response_chars,
+            data.get("first_token_ms"),
             usage_metrics,
         )
         return {
             "text": text,
             "usage": usage_metrics,
             "finish_reason": finish_reason,
+            "first_token_ms": data.get("first_token_ms"),
         }
 
+    def _raise_openai_error(
+        self, exc: httpx.HTTPStatusError, label: str = "OpenAI API error"
+    ) -> NoReturn:
+        response = exc.response
+        status = response.status_code if response is not None else None
+        retry_after = _parse_retry_after(response)
+        self._note_rate_limit(status, retry_after)
+        detail = response.text if response is not None else exc
+        raise LLMProviderError(
+            f"{label} ({status}): {detail}",
+            retryable=_is_retryable(status),
+            retry_after=retry_after,
+        ) from exc
+
+    def _note_rate_limit(self, status: Optional[int], retry_after: Optional[float]) -> None:
+        # Every request waits on the shared bucket before it is sent, so pausing it
+        # holds back other tasks instead of letting them spend a round-trip on a 429.
+        if status == 429:
+            self._bucket.pause(min(retry_after or 1.0, _BACKOFF_MAX_SECONDS))
+
+    async def embed_text(self, text: str, model: str) -> List[float]:
+        url = _OPENAI_EMBEDDINGS_URL
+        async with self._semaphore:
+            await self._bucket.acquire()
+            client = _get_http_client(url, model)
+            try:
+                response = await client.post(
+                    url,
+                    headers=self._headers,
+                    content=orjson.dumps({"model": model, "input": text}),
+                    timeout=self._timeout,
+                )
+                response.raise_for_status()
+            except httpx.HTTPStatusError as exc:
+                self._raise_openai_error(exc, "OpenAI embeddings error")
+            except (httpx.TimeoutException, httpx.TransportError) as exc:
+                raise LLMProviderError(
+                    f"OpenAI embeddings request failed: {exc}", retryable=True
+                ) from exc
+        data = orjson.loads(response.content)
+        return data["data"][0]["embedding"]
+
+
+_RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504, 529})
+
+
+def _is_retryable(status: Optional[int]) -> bool:
+    return status is not None and (status in _RETRYABLE_STATUSES or status >= 500)
+
+
+def _parse_retry_after(response: Optional[httpx.Response]) -> Optional[float]:
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+async def _read_completion_stream(
+    response: httpx.Response, started_at: Optional[float] = None
+) -> Dict[str, Any]:
+    """Assemble a chat completion body from OpenAI server-sent events."""
+    if started_at is None:
+        started_at = time.monotonic()
+    first_token_ms: Optional[float] = None
+    parts: List[str] = []
+    finish_reason: Optional[str] = None
+    usage: Dict[str, Any] = {}
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        try:
+            event = orjson.loads(data)
+        except orjson.JSONDecodeError as exc:
+            raise LLMProviderError(
+                f"OpenAI stream returned invalid event: {data[:200]}",
+                retryable=True,
+            ) from exc
+        if event.get("usage"):
+            usage = event["usage"]
+        for choice in event.get("choices") or []:
+            content = (choice.get("delta") or {}).get("content")
+            if content:
+                if first_token_ms is None:
+                    first_token_ms = (time.monotonic() - started_at) * 1000
+                parts.append(content)
+            if choice.get("finish_reason"):
+                finish_reason = choice["finish_reason"]
+    return {
+        "choices": [{"message": {"content": "".join(parts)}, "finish_reason": finish_reason}],
+        "usage": usage,
+        "first_token_ms": first_token_ms,
+    }
+
 
 def get_llm_provider(settings: LLMSettings) -> LLMProvider:
     if settings.provider == "openai":
         if not settings.api_key:
             raise LLMProviderError("LLM_API_KEY is required for OpenAI provider.", retryable=False)
-        return OpenAIProvider(settings.api_key, settings.timeout_seconds)
+        return OpenAIProvider(
+            settings.api_key,
+            settings.timeout_seconds,
+            max_concurrency=settings.max_concurrency,
+            requests_per_minute=settings.requests_per_minute,
+        )
     return MockProvider()
 
 
@@ -295,31 +909,31 @@ async def generate_text_chunks_json(
     chunk_limit = max_chunks or settings.max_chunks
     char_limit = max_file_chars or settings.max_file_chars
     token_limit = max_tokens or settings.max_tokens
-    total_usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
-    aggregated = []
+    total_usage = Usage()
+    aggregated: List[str] = []
+    aggregated_len = 0
+    tail_text = ""
     response_format = _resolve_response_format(settings.response_format, True)
     temperature = 0.0
+    prepared_base_messages = _inject_json_system_instruction(base_messages, provider, True)
 
     for chunk_index in range(1, chunk_limit + 1):
-        if char_limit > 0 and sum(len(chunk) for chunk in aggregated) >= char_limit:
+        if char_limit > 0 and aggregated_len >= char_limit:
             raise LLMOutputTruncatedError(
                 "llm_output_budget_exceeded",
-                usage=total_usage,
+                usage=total_usage._asdict(),
                 finish_reason="max_file_chars",
             )
         invalid_attempts = 0
         last_error_text = ""
         while True:
-            messages = _build_chunk_messages(
-                base_messages=base_messages,
+            prepared_messages = _build_chunk_messages(
+                base_messages=prepared_base_messages,
                 chunk_index=chunk_index,
-                remaining_chars=char_limit - sum(len(chunk) for chunk in aggregated)
-                if char_limit > 0
-                else None,
-                tail_text=_tail_text("".join(aggregated)),
+                remaining_chars=char_limit - aggregated_len if char_limit > 0 else None,
+                tail_text=tail_text,
                 invalid_json=invalid_attempts > 0,
             )
-            prepared_messages = _inject_json_system_instruction(messages, provider, True)
             response = await provider.generate_text(
                 messages=prepared_messages,
                 model=settings.model,
@@ -328,7 +942,7 @@ async def generate_text_chunks_json(
                 response_format=response_format,
             )
             usage = response.get("usage", {}) or {}
-            total_usage = _accumulate_usage(total_usage, usage)
+            total_usage = _accumulate_usage(total_usage, Usage.from_mapping(usage))
             text = response.get("text", "") or ""
             try:
                 payload = _parse_chunk_payload(text, expected_index=chunk_index)
@@ -338,24 +952,25 @@ async def generate_text_chunks_json(
                     raise LLMInvalidResponseError(
                         "llm_invalid_json",
                         raw_text=last_error_text,
-                        usage=total_usage,
+                        usage=total_usage._asdict(),
                     ) from exc
                 invalid_attempts += 1
                 continue
             content_chunk = payload["content_chunk"]
             if content_chunk:
                 aggregated.append(content_chunk)
-            combined = "".join(aggregated)
-            if char_limit > 0 and len(combined) > char_limit:
+                aggregated_len += len(content_chunk)
+                tail_text = _tail_text(tail_text + content_chunk)
+            if char_limit > 0 and aggregated_len > char_limit:
                 raise LLMOutputTruncatedError(
                     "llm_output_budget_exceeded",
-                    usage=total_usage,
+                    usage=total_usage._asdict(),
                     finish_reason="max_file_chars",
                 )
             if payload["status"] == "complete":
                 return {
-                    "text": combined,
-                    "usage": total_usage,
+                    "text": "".join(aggregated),
+                    "usage": total_usage._asdict(),
                     "chunks": chunk_index,
                     "finish_reason": "complete",
                 }
@@ -363,7 +978,7 @@ async def generate_text_chunks_json(
 
     raise LLMOutputTruncatedError(
         "llm_output_truncated",
-        usage=total_usage,
+        usage=total_usage._asdict(),
         finish_reason="max_chunks",
     )
 
@@ -373,26 +988,107 @@ async def generate_with_retry(
     messages: List[Dict[str, str]],
     settings: LLMSettings,
     *,
-    max_retries: int = 2,
+    max_retries: int = 5,
     require_json: bool = False,
     max_tokens_override: Optional[int] = None,
+) -> Dict[str, Any]:
+    response_format = _resolve_response_format(settings.response_format, require_json)
+    temperature = 0.0 if require_json else settings.temperature
+    max_tokens = max_tokens_override or settings.max_tokens
+    cache = _get_result_cache(settings) if temperature == 0.0 else None
+    cache_key: Optional[str] = None
+    if cache is not None:
+        cache_key = ResultCache.make_key(
+            provider.name,
+            settings.model,
+            messages,
+            temperature,
+            response_format,
+            max_tokens,
+        )
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return _cached_response(cached)
+
+    semantic_cache = (
+        _get_semantic_cache(settings) if temperature == 0.0 and not require_json else None
+    )
+    embed_text = getattr(provider, "embed_text", None)
+    semantic_namespace: Optional[str] = None
+    embedding: Optional[List[float]] = None
+    if semantic_cache is not None and embed_text is not None and messages:
+        try:
+            embedding = await embed_text(
+                str(messages[-1].get("content", "")),
+                settings.embedding_model,
+            )
+        except LLMProviderError:
+            logger.warning("Semantic cache embedding failed; skipping lookup", exc_info=True)
+        if embedding is not None:
+            semantic_namespace = SemanticCache.make_namespace(
+                provider.name,
+                settings.model,
+                messages,
+                max_tokens,
+            )
+            cached = semantic_cache.lookup(semantic_namespace, embedding)
+            if cached is not None:
+                return _cached_response(cached)
+
+    response = await _generate_with_retry_uncached(
+        provider,
+        messages,
+        settings,
+        max_retries=max_retries,
+        require_json=require_json,
+        max_tokens=max_tokens,
+    )
+    if cache_key is None and semantic_namespace is None:
+        return response
+    entry = {
+        "text": response.get("text", ""),
+        "usage": dict(response.get("usage") or {}),
+        "finish_reason": response.get("finish_reason"),
+    }
+    if cache is not None and cache_key is not None:
+        cache.set(cache_key, entry)
+    if semantic_cache is not None and semantic_namespace is not None and embedding is not None:
+        semantic_cache.store(semantic_namespace, embedding, entry)
+    return response
+
+
+def _cached_response(entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "text": entry["text"],
+        "usage": {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0},
+        "finish_reason": entry["finish_reason"],
+        "cache_hit": True,
+    }
+
+
+async def _generate_with_retry_uncached(
+    provider: LLMProvider,
+    messages: List[Dict[str, str]],
+    settings: LLMSettings,
+    *,
+    max_retries: int,
+    require_json: bool,
+    max_tokens: int,
 ) -> Dict[str, Any]:
     attempt = 0
-    delay = 1.0
     response_format = _resolve_response_format(settings.response_format, require_json)
     temperature = 0.0 if require_json else settings.temperature
     prepared_messages = _inject_json_system_instruction(messages, provider, require_json)
-    max_tokens = max_tokens_override or settings.max_tokens
     truncation_retries = 0
     max_truncation_retries = 1
     continuation_attempts = 0
     max_continuations = 3
-    total_usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+    total_usage = Usage()
     continuation_messages = prepared_messages
     combined_chunks: List[str] = []
     continuation_prompt = (
-        "Continue EXACTLY from where you stopped. Do not repeat. "
-        "Output only the remaining content."
+        "Continue EXACTLY from where you stopped; your previous message shows the end "
+        "of the output so far. Do not repeat. Output only the remaining content."
     )
     while True:
         try:
@@ -404,14 +1100,7 @@ async def generate_with_retry(
                 response_format=response_format,
             )
             usage = response.get("usage", {}) or {}
-            total_usage["input_tokens"] += int(usage.get("input_tokens", 0) or 0)
-            total_usage["output_tokens"] += int(usage.get("output_tokens", 0) or 0)
-            if usage.get("total_tokens") is not None:
-                total_usage["total_tokens"] += int(usage.get("total_tokens", 0) or 0)
-            else:
-                total_usage["total_tokens"] += int(usage.get("input_tokens", 0) or 0) + int(
-                    usage.get("output_tokens", 0) or 0
-                )
+            total_usage = _accumulate_usage(total_usage, Usage.from_mapping(usage))
 
             finish_reason = response.get("finish_reason")
             text = response.get("text", "") or ""
@@ -426,32 +1115,191 @@ async def generate_with_retry(
                 combined_chunks.append(text)
                 if continuation_attempts < max_continuations:
                     continuation_attempts += 1
-                    aggregated_text = "".join(combined_chunks)
+                    aggregated_tail = _tail_text(
+                        "".join(combined_chunks),
+                        settings.continuation_tail_chars,
+                    )
                     continuation_messages = prepared_messages + [
-                        {"role": "assistant", "content": aggregated_text},
+                        {"role": "assistant", "content": aggregated_tail},
                         {"role": "user", "content": continuation_prompt},
                     ]
                     continue
                 raise LLMOutputTruncatedError(
                     "llm_output_truncated",
-                    usage=total_usage,
+                    usage=total_usage._asdict(),
                     finish_reason=finish_reason,
                 )
             if combined_chunks:
                 combined_chunks.append(text)
                 text = "".join(combined_chunks)
             response["finish_reason"] = finish_reason
-            response["usage"] = total_usage
+            response["usage"] = total_usage._asdict()
             response["text"] = text
             return response
         except LLMProviderError as exc:
             if attempt >= max_retries or not exc.retryable:
                 raise
-            await asyncio.sleep(delay)
-            delay *= 2
+            # A hostile or misconfigured Retry-After must not park the task for hours.
+            await asyncio.sleep(
+                min(exc.retry_after, _BACKOFF_MAX_SECONDS)
+                if exc.retry_after is not None
+                else _backoff_delay(attempt)
+            )
             attempt += 1
 
 
+async def generate_batch(
+    provider: LLMProvider,
+    requests: List[Dict[str, Any]],
+    settings: LLMSettings,
+    *,
+    concurrency: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Run independent generate_with_retry requests concurrently.
+
+    Each request is a dict with ``messages`` and optional ``kwargs`` forwarded to
+    generate_with_retry. Results are returned in request order; the first failure
+    cancels the remaining requests.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency or settings.max_concurrency))
+
+    async def _run(request: Dict[str, Any]) -> Dict[str, Any]:
+        async with semaphore:
+            return await generate_with_retry(
+                provider,
+                request["messages"],
+                settings,
+                **request.get("kwargs", {}),
+            )
+
+    async with asyncio.TaskGroup() as task_group:
+        tasks = [task_group.create_task(_run(request)) for request in requests]
+    return [task.result() for task in tasks]
+
+
+async def generate_many(
+    provider: LLMProvider,
+    batch: List[List[Dict[str, str]]],
+    settings: LLMSettings,
+    *,
+    concurrency: int = 8,
+    require_json: bool = False,
+) -> List[Union[Dict[str, Any], BaseException]]:
+    """Run one generate_with_retry call per message list, tolerating failures.
+
+    Unlike generate_batch, a failing request does not cancel the others: its
+    exception is returned in place of the result.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _guarded(messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        async with semaphore:
+            return await generate_with_retry(
+                provider,
+                messages,
+                settings,
+                require_json=require_json,
+            )
+
+    return await asyncio.gather(*(_guarded(messages) for messages in batch), return_exceptions=True)
+
+
+class BinnedDispatcher:
+    """Queue requests into bins by output budget and dispatch each bin as a batch.
+
+    Requests with similar max_tokens finish at similar times, so a long generation
+    does not hold back a batch of short ones. A bin is flushed when it reaches
+    batch_size or max_wait_ms after its first request, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        provider: LLMProvider,
+        settings: LLMSettings,
+        *,
+        bin_edges: Tuple[int, ...] = (128, 512, 2048, 8192),
+        batch_size: int = 8,
+        max_wait_ms: float = 20.0,
+    ) -> None:
+        self.provider = provider
+        self.settings = settings
+        self.bin_edges = tuple(sorted(bin_edges))
+        self.batch_size = max(1, batch_size)
+        self.max_wait_seconds = max_wait_ms / 1000
+        self._bins: Dict[int, List[Tuple[List[Dict[str, str]], int, bool, asyncio.Future]]] = {}
+        self._timers: Dict[int, asyncio.Task] = {}
+        self._dispatches: Set[asyncio.Task] = set()
+
+    async def submit(
+        self,
+        messages: List[Dict[str, str]],
+        *,
+        max_tokens: Optional[int] = None,
+        require_json: bool = False,
+    ) -> Dict[str, Any]:
+        budget = max_tokens or self.settings.max_tokens
+        bin_index = bisect.bisect_left(self.bin_edges, budget)
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        pending = self._bins.setdefault(bin_index, [])
+        pending.append((messages, budget, require_json, future))
+        if len(pending) >= self.batch_size:
+            self._flush(bin_index)
+        elif bin_index not in self._timers:
+            self._timers[bin_index] = asyncio.create_task(self._flush_after_wait(bin_index))
+        return await future
+
+    async def _flush_after_wait(self, bin_index: int) -> None:
+        await asyncio.sleep(self.max_wait_seconds)
+        self._timers.pop(bin_index, None)
+        self._flush(bin_index)
+
+    def _flush(self, bin_index: int) -> None:
+        timer = self._timers.pop(bin_index, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._bins.pop(bin_index, [])
+        if not batch:
+            return
+        task = asyncio.create_task(self._dispatch(batch))
+        self._dispatches.add(task)
+        task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(
+        self,
+        batch: List[Tuple[List[Dict[str, str]], int, bool, asyncio.Future]],
+    ) -> None:
+        results = await asyncio.gather(
+            *(
+                generate_with_retry(
+                    self.provider,
+                    messages,
+                    self.settings,
+                    require_json=require_json,
+                    max_tokens_override=budget,
+                )
+                for messages, budget, require_json, _ in batch
+            ),
+            return_exceptions=True,
+        )
+        for (_, _, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+_BACKOFF_BASE_SECONDS = 1.0
+_BACKOFF_MAX_SECONDS = 60.0
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Exponential backoff with equal jitter so concurrent retries spread out."""
+    ceiling = min(_BACKOFF_MAX_SECONDS, _BACKOFF_BASE_SECONDS * 2**attempt)
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
 def _resolve_response_format(
     response_format: str,
     require_json: bool,
@@ -470,6 +1318,9 @@ def _resolve_response_format(
     return {"type": "json_object"}
 
 
+_JSON_ONLY_INSTRUCTION = "OUTPUT JSON ONLY. No markdown. No extra keys."
+
+
 def _inject_json_system_instruction(
     messages: List[Dict[str, str]],
     provider: LLMProvider,
@@ -477,17 +1328,29 @@ def _inject_json_system_instruction(
 ) -> List[Dict[str, str]]:
     if not require_json or provider.name != "openai":
         return messages
-    instruction = "OUTPUT JSON ONLY. No markdown. No extra keys."
-    if not messages:
-        return [{"role": "system", "content": instruction}]
-    updated = [dict(message) for message in messages]
-    if updated[0].get("role") == "system":
-        content = updated[0].get("content", "")
-        if instruction not in content:
-            updated[0]["content"] = f"{content.rstrip()}\n{instruction}"
-        return updated
-    updated.insert(0, {"role": "system", "content": instruction})
-    return updated
+    # Keep the static instruction as its own leading system message rather than
+    # editing the caller's system prompt, so every JSON request shares the same
+    # prefix and stays eligible for provider-side prompt caching.
+    if messages and messages[0].get("content") == _JSON_ONLY_INSTRUCTION:
+        return messages
+    return [{"role": "system", "content": _JSON_ONLY_INSTRUCTION}, *messages]
+
+
+_CHUNK_SCHEMA_HEADER: Tuple[str, ...] = (
+    "Return ONLY a JSON object that matches this schema exactly:",
+    (
+        '{\n'
+        '  "status": "partial" | "complete",\n'
+        '  "chunk_index": 1,\n'
+        '  "content_chunk": "string (may be empty)",\n'
+        '  "notes": "optional short string"\n'
+        "}"
+    ),
+    "Rules:",
+    "- content_chunk must be raw text (no markdown fences).",
+    "- status=partial means send the next chunk continuing exactly where you stopped.",
+    "- status=complete ends the stream.",
+)
 
 
 def _build_chunk_messages(
@@ -498,23 +1361,7 @@ def _build_chunk_messages(
     tail_text: str,
     invalid_json: bool,
 ) -> List[Dict[str, str]]:
-    schema = (
-        '{\n'
-        '  "status": "partial" | "complete",\n'
-        '  "chunk_index": 1,\n'
-        '  "content_chunk": "string (may be empty)",\n'
-        '  "notes": "optional short string"\n'
-        "}"
-    )
-    instructions = [
-        "Return ONLY a JSON object that matches this schema exactly:",
-        schema,
-        "Rules:",
-        "- content_chunk must be raw text (no markdown fences).",
-        "- status=partial means send the next chunk continuing exactly where you stopped.",
-        "- status=complete ends the stream.",
-        f"- chunk_index must be {chunk_index}.",
-    ]
+    instructions = [*_CHUNK_SCHEMA_HEADER, f"- chunk_index must be {chunk_index}."]
     if remaining_chars is not None:
         instructions.append(f"- Remaining character budget: {remaining_chars}.")
     if chunk_index == 1:
@@ -528,50 +1375,36 @@ def _build_chunk_messages(
         instructions.append("Begin the file content now.")
     if invalid_json:
         instructions.append("Return JSON object only. Do not include any extra text.")
-    messages = [dict(message) for message in base_messages]
-    messages.append({"role": "user", "content": "\n".join(instructions)})
-    return messages
+    return [*base_messages, {"role": "user", "content": "\n".join(instructions)}]
 
 
 def _parse_chunk_payload(text: str, *, expected_index: Optional[int] = None) -> Dict[str, Any]:
-    payload = json.loads(text)
-    if not isinstance(payload, dict):
-        raise ValueError("Chunk payload must be a JSON object.")
-    status = payload.get("status")
-    if status not in {"partial", "complete"}:
-        raise ValueError("Chunk status must be 'partial' or 'complete'.")
-    if expected_index is not None:
-        chunk_index = payload.get("chunk_index")
-        if chunk_index != expected_index:
-            raise ValueError(f"chunk_index must be {expected_index}.")
-    content_chunk = payload.get("content_chunk")
-    if content_chunk is None:
-        raise ValueError("content_chunk is required.")
-    if not isinstance(content_chunk, str):
-        content_chunk = str(content_chunk)
+    payload = ChunkPayload.model_validate_json(text)
+    if expected_index is not None and payload.chunk_index != expected_index:
+        raise ValueError(f"chunk_index must be {expected_index}.")
     return {
-        "status": status,
-        "content_chunk": content_chunk,
+        "status": payload.status,
+        "content_chunk": payload.content_chunk,
     }
 
 
-def _accumulate_usage(
-    total_usage: Dict[str, int],
-    usage: Dict[str, Any],
-) -> Dict[str, int]:
-    total_usage["input_tokens"] += int(usage.get("input_tokens", 0) or 0)
-    total_usage["output_tokens"] += int(usage.get("output_tokens", 0) or 0)
-    if usage.get("total_tokens") is not None:
-        total_usage["total_tokens"] += int(usage.get("total_tokens", 0) or 0)
-    else:
-        total_usage["total_tokens"] += int(usage.get("input_tokens", 0) or 0) + int(
-            usage.get("output_tokens", 0) or 0
-        )
-    return total_usage
+def _accumulate_usage(total_usage: Usage, usage: Usage) -> Usage:
+    return Usage(
+        total_usage.input_tokens + usage.input_tokens,
+        total_usage.output_tokens + usage.output_tokens,
+        total_usage.total_tokens + usage.total_tokens,
+    )
 
 
 def _parse_bool_env(value: str) -> bool:
-    return str(value or "").strip().lower() not in {"0", "false", "no", "off"}
+    return str(value or "").strip().lower() not in _FALSY_ENV_VALUES
+
+
+def _estimate_tokens(text: str) -> int:
+    """Approximate whitespace-delimited word count without splitting the text."""
+    if not text:
+        return 1
+    return text.count(" ") + text.count("\n") + 1
 
 
 def _tail_text(text: str, max_chars: int = 500) -> str:
@@ -583,9 +1416,11 @@ def _tail_text(text: str, max_chars: int = 500) -> str:
 
 
 def _extract_between(text: str, start: str, end: str) -> str:
-    if start not in text:
+    start_index = text.find(start)
+    if start_index < 0:
         return ""
-    after = text.split(start, 1)[1]
-    if end in after:
-        return after.split(end, 1)[0]
-    return after
+    value_start = start_index + len(start)
+    value_end = text.find(end, value_start)
+    if value_end < 0:
+        return text[value_start:]
+    return text[value_start:value_end]
@@ -4,29 +4,81 @@ from __future__ import annotations
 
 import contextvars
 import logging
+import os
 from typing import Optional
 
+import orjson
+
 request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
 task_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("task_id", default=None)
 
+_MISSING = "-"
+
+
+def _install_record_factory() -> None:
+    base_factory = logging.getLogRecordFactory()
+    if getattr(base_factory, "_correlation_aware", False):
+        return
+
+    def record_factory(
+        *args,
+        _base=base_factory,
+        _request_get=request_id_var.get,
+        _task_get=task_id_var.get,
+        **kwargs,
+    ) -> logging.LogRecord:
+        record = _base(*args, **kwargs)
+        record.request_id = _request_get() or _MISSING
+        record.task_id = _task_get() or _MISSING
+        return record
+
+    record_factory._correlation_aware = True  # type: ignore[attr-defined]
+    logging.setLogRecordFactory(record_factory)
+
 
 class CorrelationFilter(logging.Filter):
+    """Fallback for records built outside the installed record factory."""
+
     def filter(self, record: logging.LogRecord) -> bool:
-        record.request_id = request_id_var.get() or "-"
-        record.task_id = task_id_var.get() or "-"
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id_var.get() or _MISSING
+            record.task_id = task_id_var.get() or _MISSING
         return True
 
 
+class JSONFormatter(logging.Formatter):
+    """One orjson object per record, keyed the same way as the text format."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", _MISSING),
+            "task_id": getattr(record, "task_id", _MISSING),
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
 def configure_logging() -> None:
+    _install_record_factory()
     root_logger = logging.getLogger()
     if not root_logger.handlers:
-        logging.basicConfig(
-            level=logging.INFO,
-            format=(
-                "%(asctime)s level=%(levelname)s logger=%(name)s "
-                "request_id=%(request_id)s task_id=%(task_id)s message=\"%(message)s\""
-            ),
-        )
+        if os.getenv("LOG_FORMAT", "json").strip().lower() == "text":
+            logging.basicConfig(
+                level=logging.INFO,
+                format=(
+                    "%(asctime)s level=%(levelname)s logger=%(name)s "
+                    "request_id=%(request_id)s task_id=%(task_id)s message=\"%(message)s\""
+                ),
+            )
+        else:
+            handler = logging.StreamHandler()
+            handler.setFormatter(JSONFormatter())
+            logging.basicConfig(level=logging.INFO, handlers=[handler])
     for handler in root_logger.handlers:
         handler.addFilter(CorrelationFilter())
 
@@ -8,37 +8,42 @@ from fastapi.exceptions import RequestValidationError
 from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse, PlainTextResponse
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse, Response, StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
-from contextlib import asynccontextmanager
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager, suppress
 from dataclasses import dataclass
+from functools import lru_cache
 import base64
 import uuid
 import json
 import asyncio
-import io
 import zipfile
-from typing import Dict, Optional, List, Any, Callable
+from typing import IO, Deque, Dict, Optional, List, Any, Callable, Set
 import logging
 import os
 from pathlib import Path, PurePosixPath
 from datetime import datetime, timedelta, timezone
 import hashlib
+import hmac
 import mimetypes
 import difflib
 import platform
 import shutil
 import subprocess
 import sys
+import tempfile
 import time
 from urllib.parse import urlparse
 import re
 
 import httpx
+import orjson
 
 from .models import Container, ProjectState
 from .orchestrator import AIOrchestrator
 from .agents import AIReviewer, SafeCommandRunner
+from .llm import close_http_clients, load_llm_settings, reload_llm_settings
 from .schemas import (
     ArtifactsResponse,
     ArtifactItem,
@@ -127,14 +132,38 @@ class CreatePullRequestRequest(BaseModel):
     branch_name: Optional[str] = None
     draft: Optional[bool] = False
 
-# Глобальное хранилище (в продакшене заменить на Redis/БД)
+class ContainerCache(OrderedDict):
+    """LRU-словарь контейнеров; maxsize=0 — без ограничения."""
+
+    def __init__(self, maxsize: int = 0):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def get(self, key, default=None):
+        if key in self:
+            self.move_to_end(key)
+            return self[key]
+        return default
+
+    def __setitem__(self, key, value) -> None:
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if self.maxsize > 0:
+            while len(self) > self.maxsize:
+                self.popitem(last=False)
+
+
+# Хранилище процесса: основное при работе без DATABASE_URL (тогда только один воркер),
+# с Postgres — кэш поверх БД
 class Storage:
     def __init__(self):
         self.active_tasks: Dict[str, Dict] = {}
-        self.containers: Dict[str, Container] = {}
-        self.user_sessions: Dict[str, List[str]] = {}  # user_id -> [task_ids]
-        self.events: Dict[str, List[Dict[str, Any]]] = {}
-        self.artifacts: Dict[str, List[Dict[str, Any]]] = {}
+        self.containers: ContainerCache = ContainerCache()
+        self.user_sessions: Dict[str, Deque[str]] = {}  # user_id -> последние task_id
+        self.events: Dict[str, List["InMemoryEvent"]] = {}
+        self.artifacts: Dict[str, List["InMemoryArtifact"]] = {}
+        # task_id -> type -> артефакты того же типа, в порядке добавления
+        self.artifacts_by_type: Dict[str, Dict[str, List["InMemoryArtifact"]]] = {}
         self.state: Dict[str, Dict[str, Any]] = {}
         self.projects: Dict[str, Dict[str, Any]] = {}
         self.oauth_accounts: Dict[str, Dict[str, Dict[str, Any]]] = {}
@@ -158,9 +187,9 @@ if (
 ):
     TEMPLATES_DIR = FALLBACK_TEMPLATES_DIR
 WORKSPACE_TTL_DAYS_ENV = os.getenv("WORKSPACE_TTL_DAYS")
-COMMAND_TIMEOUT_SECONDS = os.getenv("COMMAND_TIMEOUT_SECONDS")
-COMMAND_MAX_OUTPUT_BYTES = os.getenv("COMMAND_MAX_OUTPUT_BYTES")
-ALLOWED_COMMANDS = os.getenv("ALLOWED_COMMANDS")
+COMMAND_TIMEOUT_SECONDS_ENV = os.getenv("COMMAND_TIMEOUT_SECONDS")
+COMMAND_MAX_OUTPUT_BYTES_ENV = os.getenv("COMMAND_MAX_OUTPUT_BYTES")
+ALLOWED_COMMANDS_ENV = os.getenv("ALLOWED_COMMANDS")
 MAX_CONCURRENT_TASKS_ENV = os.getenv("MAX_CONCURRENT_TASKS")
 RATE_LIMIT_CREATE_TASKS_PER_MIN_ENV = os.getenv("RATE_LIMIT_CREATE_TASKS_PER_MIN")
 RATE_LIMIT_RERUN_REVIEW_PER_MIN_ENV = os.getenv("RATE_LIMIT_RERUN_REVIEW_PER_MIN")
@@ -180,40 +209,114 @@ class AuthContext:
 # WebSocket менеджер
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+        # task_id -> сокеты всех клиентов, подписанных на задачу
+        self.active_connections: Dict[str, Set[WebSocket]] = {}
+        # Отложенные обновления прогресса: за окно debounce собирается и уходит только последнее
+        self._pending_progress: Dict[str, Callable[[], Optional[dict]]] = {}
+        self._progress_handles: Dict[str, asyncio.TimerHandle] = {}
+        # Последняя отправка по задаче: следующая ждет ее, чтобы кадры не обгоняли друг друга
+        self._progress_sends: Dict[str, asyncio.Task] = {}
     
     async def connect(self, websocket: WebSocket, task_id: str):
         await websocket.accept()
-        self.active_connections[task_id] = websocket
+        self.active_connections.setdefault(task_id, set()).add(websocket)
         logger.info("WebSocket connected for task_id=%s", task_id)
     
-    def disconnect(self, task_id: str):
-        if task_id in self.active_connections:
+    def disconnect(self, task_id: str, websocket: WebSocket):
+        sockets = self.active_connections.get(task_id)
+        if not sockets or websocket not in sockets:
+            return
+        sockets.discard(websocket)
+        if not sockets:
             del self.active_connections[task_id]
-            logger.info("WebSocket disconnected for task_id=%s", task_id)
+        logger.info("WebSocket disconnected for task_id=%s", task_id)
+
+    def connection_count(self) -> int:
+        return sum(len(sockets) for sockets in self.active_connections.values())
     
     async def send_progress(self, task_id: str, data: dict):
-        await record_event(task_id, "ProgressUpdate", normalize_payload(data))
-        if task_id in self.active_connections:
-            try:
-                await self.active_connections[task_id].send_json(jsonable_encoder(data))
-                return True
-            except Exception as e:
-                logger.error("Error sending WebSocket message for task_id=%s: %s", task_id, e)
-                self.disconnect(task_id)
-        return False
+        await record_event(task_id, "ProgressUpdate", data)
+        sockets = self.active_connections.get(task_id)
+        if not sockets:
+            return False
+        text = orjson.dumps(data, default=jsonable_encoder, option=_ORJSON_OPTIONS).decode("utf-8")
+        delivered = False
+        targets = list(sockets)
+        for start in range(0, len(targets), PROGRESS_FANOUT_CHUNK):
+            if start:
+                # Отдаем управление циклу между пачками, чтобы большая рассылка не блокировала его
+                await asyncio.sleep(0)
+            for websocket in targets[start:start + PROGRESS_FANOUT_CHUNK]:
+                try:
+                    await websocket.send_text(text)
+                    delivered = True
+                except Exception as e:
+                    logger.error("Error sending WebSocket message for task_id=%s: %s", task_id, e)
+                    self.disconnect(task_id, websocket)
+        return delivered
+
+    def schedule_progress(self, task_id: str, build_payload: Callable[[], Optional[dict]]) -> None:
+        self._pending_progress[task_id] = build_payload
+        if task_id in self._progress_handles:
+            return
+        self._progress_handles[task_id] = asyncio.get_running_loop().call_later(
+            PROGRESS_DEBOUNCE_MS / 1000,
+            self._flush_progress,
+            task_id,
+        )
+
+    def _flush_progress(self, task_id: str) -> None:
+        self._progress_handles.pop(task_id, None)
+        build_payload = self._pending_progress.pop(task_id, None)
+        data = build_payload() if build_payload else None
+        if data is None:
+            return
+        previous = self._progress_sends.get(task_id)
+        task = asyncio.create_task(self._send_after(previous, task_id, data))
+        self._progress_sends[task_id] = task
+        task.add_done_callback(lambda done: self._forget_send(task_id, done))
+
+    async def _send_after(self, previous: Optional[asyncio.Task], task_id: str, data: dict) -> None:
+        if previous is not None:
+            with suppress(Exception):
+                await previous
+        try:
+            await self.send_progress(task_id, data)
+        except Exception:
+            logger.exception("Failed to send progress for task_id=%s", task_id)
+
+    def _forget_send(self, task_id: str, task: asyncio.Task) -> None:
+        if self._progress_sends.get(task_id) is task:
+            del self._progress_sends[task_id]
+
+    async def flush_progress(self, task_id: str) -> None:
+        """Немедленно отправляет отложенный прогресс задачи и дожидается всех ее отправок."""
+        handle = self._progress_handles.get(task_id)
+        if handle is not None:
+            handle.cancel()
+            self._flush_progress(task_id)
+        send = self._progress_sends.get(task_id)
+        if send is not None:
+            await send
+
+    async def drain_progress(self) -> None:
+        for task_id in list(self._progress_handles) + list(self._progress_sends):
+            await self.flush_progress(task_id)
 
 manager = ConnectionManager()
 FILE_PERSISTENCE_ENABLED: Optional[bool] = None
 FILE_PERSISTENCE_REASON = ""
 
 
-def enrich_task_data(task_id: str, task_data: Dict[str, Any]) -> Dict[str, Any]:
+def enrich_task_data(
+    task_id: str,
+    task_data: Dict[str, Any],
+    interactive_enabled: Optional[bool] = None,
+) -> Dict[str, Any]:
     if isinstance(task_data.get("id"), uuid.UUID):
         task_data["id"] = str(task_data["id"])
-    interactive_enabled = parse_bool_env(os.getenv("ORCH_INTERACTIVE_RESEARCH"))
     if interactive_enabled is None:
-        interactive_enabled = False
+        interactive_enabled = is_interactive_research_enabled()
     container = resolve_container(task_id)
     if container:
         task_data["files_count"] = len(container.files)
@@ -281,8 +384,22 @@ def enrich_task_data(task_id: str, task_data: Dict[str, Any]) -> Dict[str, Any]:
     return task_data
 
 
+def enrich_task_rows(tasks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Строки уже получены одним запросом; флаг окружения читаем один раз на весь список
+    interactive_enabled = is_interactive_research_enabled()
+    return [enrich_task_data(str(task["id"]), task, interactive_enabled) for task in tasks]
+
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
 def normalize_payload(payload: Any) -> Any:
-    return jsonable_encoder(payload)
+    # orjson сериализует dict/list/datetime/UUID на C; остальное (pydantic, set, bytes)
+    # уходит в jsonable_encoder через default
+    try:
+        return orjson.loads(orjson.dumps(payload, default=jsonable_encoder, option=_ORJSON_OPTIONS))
+    except orjson.JSONEncodeError:
+        return jsonable_encoder(payload)
 
 
 def build_event_payload(task_id: str, payload: Optional[Dict[str, Any]]) -> Dict[str, Any]:
@@ -307,15 +424,27 @@ def require_api_key(request: Request) -> str:
     key = get_request_api_key(request)
     if not key:
         raise HTTPException(status_code=401, detail="API key required")
-    if APP_API_KEY and key != APP_API_KEY:
+    if APP_API_KEY and not api_key_matches_app_key(key):
         raise HTTPException(status_code=401, detail="Invalid API key")
     return key
 
 
+def api_key_matches_app_key(key: str) -> bool:
+    # Сравнение за постоянное время, чтобы по задержке ответа нельзя было подбирать ключ
+    return hmac.compare_digest(key.encode("utf-8"), (APP_API_KEY or "").encode("utf-8"))
+
+
+@lru_cache(maxsize=1024)
 def hash_api_key(key: str) -> str:
     return hashlib.sha256(key.encode("utf-8")).hexdigest()
 
 
+def key_hashes_match(task_owner_key_hash: Optional[str], owner_key_hash: Optional[str]) -> bool:
+    if not task_owner_key_hash or not owner_key_hash:
+        return False
+    return hmac.compare_digest(str(task_owner_key_hash), str(owner_key_hash))
+
+
 def _parse_bearer_token(authorization: Optional[str]) -> Optional[str]:
     if not authorization:
         return None
@@ -346,6 +475,18 @@ async def get_auth_context(request: Request) -> AuthContext:
     )
 
 
+async def require_admin_auth(request: Request) -> AuthContext:
+    auth_context = await get_auth_context(request)
+    if auth_context.user:
+        if auth_context.user.get("role") != "admin":
+            raise HTTPException(status_code=403, detail="Admin role required")
+        return auth_context
+    # API-ключ даёт права администратора только если он задан явно
+    if not APP_API_KEY:
+        raise HTTPException(status_code=403, detail="Admin role required")
+    return auth_context
+
+
 async def require_user_auth(request: Request) -> tuple[AuthContext, str]:
     auth_context = await get_auth_context(request)
     if not auth_context.user:
@@ -366,10 +507,10 @@ def task_access_allowed(
     if principal == "user":
         if task_owner_user_id:
             return str(task_owner_user_id) == str(owner_user_id)
-        return bool(task_owner_key_hash) and task_owner_key_hash == owner_key_hash
+        return key_hashes_match(task_owner_key_hash, owner_key_hash)
     if task_owner_user_id:
         return False
-    return bool(task_owner_key_hash) and task_owner_key_hash == owner_key_hash
+    return key_hashes_match(task_owner_key_hash, owner_key_hash)
 
 
 async def ensure_task_owner(task_id: str, request: Request) -> Dict[str, Any]:
@@ -393,6 +534,41 @@ async def ensure_task_owner(task_id: str, request: Request) -> Dict[str, Any]:
     return task_data
 
 
+TASK_OWNER_CACHE_TTL_SECONDS = 5.0
+TASK_OWNER_CACHE_MAX_ENTRIES = 10_000
+# task_id -> (истекает, owner_user_id, owner_key_hash); владелец задачи после создания не меняется.
+# LRU: при переполнении вытесняются самые давние записи, в том числе уже истекшие
+_task_owner_cache: ContainerCache = ContainerCache(maxsize=TASK_OWNER_CACHE_MAX_ENTRIES)
+
+
+async def ensure_task_access(task_id: str, request: Request) -> None:
+    """Проверка доступа для ручек чтения, которым не нужна строка задачи: владелец кэшируется на несколько секунд"""
+    if not db.is_enabled():
+        await ensure_task_owner(task_id, request)
+        return
+    auth_context = await get_auth_context(request)
+    now = time.monotonic()
+    cached = _task_owner_cache.get(task_id)
+    if cached is None or cached[0] <= now:
+        task_data = await db.get_task_row(task_id)
+        if task_data is None:
+            raise HTTPException(status_code=404, detail="Task not found")
+        cached = (
+            now + TASK_OWNER_CACHE_TTL_SECONDS,
+            task_data.get("owner_user_id"),
+            task_data.get("owner_key_hash"),
+        )
+        _task_owner_cache[task_id] = cached
+    owner_user_id = str(auth_context.user["id"]) if auth_context.user else None
+    if not task_access_allowed(
+        {"owner_user_id": cached[1], "owner_key_hash": cached[2]},
+        principal=auth_context.principal,
+        owner_key_hash=auth_context.owner_key_hash,
+        owner_user_id=owner_user_id,
+    ):
+        raise HTTPException(status_code=403, detail="Invalid credentials or no access to this task.")
+
+
 def get_websocket_api_key(websocket: WebSocket) -> Optional[str]:
     key = websocket.query_params.get("api_key") or websocket.headers.get("X-API-Key")
     if not key:
@@ -438,7 +614,7 @@ async def ensure_websocket_owner(websocket: WebSocket, task_id: str) -> Optional
             await websocket.accept()
             await websocket.close(code=4401, reason="API key required")
             return None
-        if APP_API_KEY and api_key != APP_API_KEY:
+        if APP_API_KEY and not api_key_matches_app_key(api_key):
             await websocket.accept()
             await websocket.close(code=4401, reason="Invalid API key")
             return None
@@ -468,9 +644,9 @@ async def ensure_websocket_owner(websocket: WebSocket, task_id: str) -> Optional
 
 def to_json_compatible(value: Any) -> Any:
     try:
-        return jsonable_encoder(value, custom_encoder={uuid.UUID: str})
+        return normalize_payload(value)
     except (TypeError, ValueError):
-        return json.loads(json.dumps(value, default=str))
+        return orjson.loads(orjson.dumps(value, default=str, option=_ORJSON_OPTIONS))
 
 
 def coerce_mapping_payload(value: Any, *, field_name: str) -> Dict[str, Any]:
@@ -635,15 +811,50 @@ def ensure_task_exists_in_memory(task_id: str) -> None:
         raise HTTPException(status_code=404, detail="Task not found")
 
 
+@dataclass(slots=True)
+class InMemoryEvent:
+    id: str
+    type: str
+    payload: Any
+    created_at: datetime
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "type": self.type,
+            "payload": self.payload,
+            "created_at": self.created_at,
+        }
+
+
+@dataclass(slots=True)
+class InMemoryArtifact:
+    id: str
+    type: str
+    produced_by: Optional[str]
+    payload: Any
+    created_at: datetime
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "type": self.type,
+            "produced_by": self.produced_by,
+            "payload": self.payload,
+            "created_at": self.created_at,
+        }
+
+
 def store_in_memory_event(task_id: str, event_type: str, payload: Optional[Dict[str, Any]] = None) -> None:
+    # payload уже нормализован в record_event через build_event_payload
     events = storage.events.setdefault(task_id, [])
     events.append(
-        {
-            "id": str(uuid.uuid4()),
-            "type": event_type,
-            "payload": normalize_payload(payload or {}),
-            "created_at": db.now_utc(),
-        }
+        InMemoryEvent(
+            id=str(uuid.uuid4()),
+            type=event_type,
+            payload=payload or {},
+            created_at=db.now_utc(),
+        )
     )
 
 
@@ -655,15 +866,15 @@ def store_in_memory_artifact(
 ) -> str:
     artifacts = storage.artifacts.setdefault(task_id, [])
     artifact_id = str(uuid.uuid4())
-    artifacts.append(
-        {
-            "id": artifact_id,
-            "type": artifact_type,
-            "produced_by": produced_by,
-            "payload": normalize_payload(payload or {}),
-            "created_at": db.now_utc(),
-        }
+    artifact = InMemoryArtifact(
+        id=artifact_id,
+        type=artifact_type,
+        produced_by=produced_by,
+        payload=normalize_payload(payload or {}),
+        created_at=db.now_utc(),
     )
+    artifacts.append(artifact)
+    storage.artifacts_by_type.setdefault(task_id, {}).setdefault(artifact_type, []).append(artifact)
     return artifact_id
 
 
@@ -716,10 +927,12 @@ def validate_required_answers(
 
 async def record_event(task_id: str, event_type: str, payload: Optional[Dict[str, Any]] = None) -> None:
     payload = build_event_payload(task_id, payload)
-    if db.is_enabled():
-        await db.append_event(task_id, event_type, payload)
-    else:
+    if not db.is_enabled():
         store_in_memory_event(task_id, event_type, payload)
+    elif event_flusher.is_running:
+        event_flusher.submit(task_id, event_type, payload)
+    else:
+        await db.append_event(task_id, event_type, payload)
 
 
 async def record_artifact(
@@ -757,12 +970,8 @@ def build_command_runner(
     workspace_path: Path,
     owner_key_hash: Optional[str] = None,
 ) -> SafeCommandRunner:
-    timeout_seconds = parse_int_env(COMMAND_TIMEOUT_SECONDS, 60)
-    max_output_bytes = parse_int_env(COMMAND_MAX_OUTPUT_BYTES, 20000)
-    allowed_commands = parse_allowed_commands(ALLOWED_COMMANDS)
-
     async def handle_event(event_type: str, payload: Dict[str, Any]) -> None:
-        await record_event(task_id, event_type, normalize_payload(payload))
+        await record_event(task_id, event_type, payload)
         if event_type == "command_started":
             await record_command_run(owner_key_hash)
 
@@ -774,15 +983,15 @@ def build_command_runner(
         await record_artifact(
             task_id,
             artifact_type,
-            normalize_payload(payload),
+            payload,
             produced_by=produced_by,
         )
 
     return SafeCommandRunner(
         workspace_path,
-        allowed_commands=allowed_commands,
-        timeout_seconds=timeout_seconds,
-        max_output_bytes=max_output_bytes,
+        allowed_commands=ALLOWED_COMMANDS,
+        timeout_seconds=COMMAND_TIMEOUT_SECONDS,
+        max_output_bytes=COMMAND_MAX_OUTPUT_BYTES,
         event_handler=handle_event,
         artifact_handler=handle_artifact,
     )
@@ -794,11 +1003,11 @@ async def run_review_for_task(task_id: str, container: Container) -> Dict[str, A
     await record_event(
         task_id,
         "review_started",
-        normalize_payload({"run_id": run_id, "started_at": started_at}),
+        {"run_id": run_id, "started_at": started_at},
     )
     reviewer = AIReviewer(AIOrchestrator().codex)
     workspace = TaskWorkspace(task_id, WORKSPACE_ROOT)
-    workspace.materialize(container)
+    await asyncio.to_thread(workspace.materialize, container)
     owner_key_hash = await get_task_owner_hash(task_id)
     runner = build_command_runner(task_id, workspace.path, owner_key_hash)
     review_result = await reviewer.execute(
@@ -813,30 +1022,35 @@ async def run_review_for_task(task_id: str, container: Container) -> Dict[str, A
     await record_artifact(
         task_id,
         "review_report",
-        normalize_payload(review_result),
+        review_result,
         produced_by="reviewer",
     )
     await record_event(
         task_id,
         "review_finished",
-        normalize_payload(
-            {
-                "run_id": run_id,
-                "started_at": started_at,
-                "finished_at": finished_at,
-                "passed": review_result.get("passed"),
-                "status": review_result.get("status"),
-            }
-        ),
+        {
+            "run_id": run_id,
+            "started_at": started_at,
+            "finished_at": finished_at,
+            "passed": review_result.get("passed"),
+            "status": review_result.get("status"),
+        },
     )
     await persist_container_snapshot(task_id, container)
     return review_result
 
 
+def _slice_in_order(items: List[Any], limit: int, order: str) -> List[Dict[str, Any]]:
+    # Записи добавляются только в конец, так что список уже упорядочен по created_at
+    if limit <= 0:
+        return []
+    if order == "desc":
+        return [item.as_dict() for item in items[:-limit - 1:-1]]
+    return [item.as_dict() for item in items[:limit]]
+
+
 def get_in_memory_events(task_id: str, limit: int, order: str) -> List[Dict[str, Any]]:
-    events = storage.events.get(task_id, [])
-    ordered = sorted(events, key=lambda item: item.get("created_at"), reverse=order == "desc")
-    return ordered[:limit]
+    return _slice_in_order(storage.events.get(task_id, []), limit, order)
 
 
 def get_in_memory_artifacts(
@@ -845,15 +1059,11 @@ def get_in_memory_artifacts(
     limit: int,
     order: str,
 ) -> List[Dict[str, Any]]:
-    artifacts = storage.artifacts.get(task_id, [])
     if artifact_type:
-        artifacts = [artifact for artifact in artifacts if artifact.get("type") == artifact_type]
-    ordered = sorted(
-        artifacts,
-        key=lambda item: item.get("created_at"),
-        reverse=order == "desc",
-    )
-    return ordered[:limit]
+        artifacts = storage.artifacts_by_type.get(task_id, {}).get(artifact_type, [])
+    else:
+        artifacts = storage.artifacts.get(task_id, [])
+    return _slice_in_order(artifacts, limit, order)
 
 
 def get_in_memory_state(task_id: str) -> Optional[Dict[str, Any]]:
@@ -1041,13 +1251,20 @@ def build_pr_body(
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Управление жизненным циклом приложения"""
-    logger.info("Starting AI Platform Backend...")
+    logger.info(
+        "Starting AI Platform Backend... (event loop: %s)",
+        type(asyncio.get_running_loop()).__module__,
+    )
     logger.info(
         "CORS allowlist source=%s; allowed origins=%d",
         cors_source,
         len(allowed_origins),
     )
     
+    # Ошибки в LLM_* переменных должны всплывать при старте, а не на первом запросе
+    llm_settings = load_llm_settings()
+    logger.info("LLM provider=%s model=%s", llm_settings.provider, llm_settings.model)
+
     # Создаем директории если их нет
     os.makedirs("data/tasks", exist_ok=True)
     os.makedirs("data/logs", exist_ok=True)
@@ -1070,9 +1287,12 @@ async def lifespan(app: FastAPI):
     if database_url:
         logger.info("DATABASE_URL detected, enabling Postgres persistence")
         try:
-            await db.init_db(database_url)
+            await db.init_db(database_url, statement_cache_size=DB_STATEMENT_CACHE_SIZE)
             await db.init_container_tables()
             logger.info("Container persistence enabled")
+            # Источник истины — БД, поэтому в памяти держим только горячие контейнеры
+            storage.containers.maxsize = CONTAINER_CACHE_SIZE
+            event_flusher.start()
             if TASK_TTL_DAYS > 0:
                 cleanup_counts = await db.cleanup_expired_data(TASK_TTL_DAYS)
                 if cleanup_counts:
@@ -1095,13 +1315,18 @@ async def lifespan(app: FastAPI):
     logger.info("Shutting down AI Platform Backend...")
     # Очистка ресурсов
     await task_governor.stop()
+    # Отложенный прогресс пишет события, поэтому досылаем его до остановки flusher и пула
+    await manager.drain_progress()
+    await event_flusher.stop()
+    await close_http_clients()
     await db.close_db()
 
 app = FastAPI(
     title="AI Collaboration Platform API",
     description="Backend для платформы коллаборации ИИ с Telegram Mini App",
     version="1.0.0-mvp",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 
@@ -1279,8 +1504,34 @@ def resolve_file_persistence_setting() -> tuple[bool, str]:
     return True, f"ENABLE_FILE_PERSISTENCE set to unrecognized value '{env_value}'; default enabled for non-production"
 
 
+COMMAND_TIMEOUT_SECONDS = parse_int_env(COMMAND_TIMEOUT_SECONDS_ENV, 60)
+COMMAND_MAX_OUTPUT_BYTES = parse_int_env(COMMAND_MAX_OUTPUT_BYTES_ENV, 20000)
+ALLOWED_COMMANDS = parse_allowed_commands(ALLOWED_COMMANDS_ENV)
 MAX_TASK_BYTES = parse_int_env(os.getenv("MAX_TASK_BYTES"), 50 * 1024 * 1024)
 MAX_TASK_FILES = parse_int_env(os.getenv("MAX_TASK_FILES"), 2000)
+CONTAINER_CACHE_SIZE = parse_int_env(os.getenv("CONTAINER_CACHE_SIZE"), 256)
+SNAPSHOT_DIGEST_CACHE_SIZE = max(1, parse_int_env(os.getenv("SNAPSHOT_DIGEST_CACHE_SIZE"), 1024))
+# 0 отключает кэш подготовленных запросов (нужно за pgbouncer в режиме transaction)
+DB_STATEMENT_CACHE_SIZE = max(0, parse_int_env(os.getenv("DB_STATEMENT_CACHE_SIZE"), 1024))
+USER_SESSION_MAX_TASKS = max(1, parse_int_env(os.getenv("USER_SESSION_MAX_TASKS"), 1000))
+PROGRESS_DEBOUNCE_MS = max(0, parse_int_env(os.getenv("PROGRESS_DEBOUNCE_MS"), 50))
+PROGRESS_FANOUT_CHUNK = max(1, parse_int_env(os.getenv("PROGRESS_FANOUT_CHUNK"), 50))
+ZIP_WRITE_CHUNK_SIZE = 64 * 1024
+ZIP_SPOOL_MAX_BYTES = 16 * 1024 * 1024
+ZIP_COMPRESS_LEVEL = min(max(parse_int_env(os.getenv("ZIP_COMPRESS_LEVEL"), 1), 0), 9)
+# Уже сжатые форматы: повторный deflate тратит CPU и почти ничего не выигрывает
+PRECOMPRESSED_SUFFIXES = frozenset(
+    {
+        ".7z", ".bz2", ".gif", ".gz", ".jar", ".jpeg", ".jpg", ".mp3", ".mp4",
+        ".png", ".tgz", ".webm", ".webp", ".woff", ".woff2", ".xz", ".zip",
+    }
+)
+
+
+def zip_compress_type(path: str) -> int:
+    if ZIP_COMPRESS_LEVEL <= 0 or os.path.splitext(path)[1].lower() in PRECOMPRESSED_SUFFIXES:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
 
 def get_file_persistence_setting() -> bool:
     global FILE_PERSISTENCE_ENABLED, FILE_PERSISTENCE_REASON
@@ -1289,14 +1540,20 @@ def get_file_persistence_setting() -> bool:
     return FILE_PERSISTENCE_ENABLED
 
 
+@lru_cache(maxsize=2048)
+def _parse_iso_datetime(value: str) -> Optional[datetime]:
+    # С Python 3.11 fromisoformat (C) понимает суффикс "Z"; datetime неизменяем, кэш безопасен
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
 def parse_datetime(value: Any) -> Optional[datetime]:
     if isinstance(value, datetime):
         return value
     if isinstance(value, str):
-        try:
-            return datetime.fromisoformat(value.replace("Z", "+00:00"))
-        except ValueError:
-            return None
+        return _parse_iso_datetime(value)
     return None
 
 
@@ -1310,33 +1567,39 @@ def compute_time_taken_seconds(task_data: Dict[str, Any]) -> Optional[float]:
 
 
 def aggregate_llm_usage(summaries: List[Dict[str, Any]]) -> Dict[str, Any]:
-    totals = {
-        "total_tokens_in": 0,
-        "total_tokens_out": 0,
-        "total_tokens": 0,
-        "by_stage": {},
-        "models": {},
-    }
+    tokens_in = 0
+    tokens_out = 0
+    by_stage: Dict[str, Dict[str, Any]] = {}
+    models: Counter = Counter()
     for summary in summaries:
         if not isinstance(summary, dict):
             continue
-        totals["total_tokens_in"] += summary.get("total_tokens_in", 0) or 0
-        totals["total_tokens_out"] += summary.get("total_tokens_out", 0) or 0
+        tokens_in += summary.get("total_tokens_in", 0) or 0
+        tokens_out += summary.get("total_tokens_out", 0) or 0
         for stage, values in (summary.get("by_stage") or {}).items():
-            stage_bucket = totals["by_stage"].setdefault(
-                stage,
-                {"tokens_in": 0, "tokens_out": 0, "total_tokens": 0, "models": {}},
-            )
+            stage_bucket = by_stage.get(stage)
+            if stage_bucket is None:
+                stage_bucket = by_stage[stage] = {
+                    "tokens_in": 0,
+                    "tokens_out": 0,
+                    "total_tokens": 0,
+                    "models": Counter(),
+                }
             stage_bucket["tokens_in"] += values.get("tokens_in", 0) or 0
             stage_bucket["tokens_out"] += values.get("tokens_out", 0) or 0
             stage_bucket["total_tokens"] += values.get("total_tokens", 0) or 0
-            for model, count in (values.get("models") or {}).items():
-                stage_bucket["models"][model] = stage_bucket["models"].get(model, 0) + count
-        for model, count in (summary.get("models") or {}).items():
-            totals["models"][model] = totals["models"].get(model, 0) + count
+            stage_bucket["models"].update(values.get("models") or {})
+        models.update(summary.get("models") or {})
 
-    totals["total_tokens"] = totals["total_tokens_in"] + totals["total_tokens_out"]
-    return totals
+    for stage_bucket in by_stage.values():
+        stage_bucket["models"] = dict(stage_bucket["models"])
+    return {
+        "total_tokens_in": tokens_in,
+        "total_tokens_out": tokens_out,
+        "total_tokens": tokens_in + tokens_out,
+        "by_stage": by_stage,
+        "models": dict(models),
+    }
 
 
 @dataclass
@@ -1437,8 +1700,98 @@ class TaskGovernor:
             self._queue.task_done()
 
 
+class EventFlusher:
+    """Копит события задач и пишет их в БД пачками вместо INSERT на каждое."""
+
+    def __init__(
+        self,
+        max_batch: int = 500,
+        interval_seconds: float = 0.02,
+        flush_timeout_seconds: float = 5.0,
+    ) -> None:
+        self.max_batch = max(1, max_batch)
+        self.interval_seconds = interval_seconds
+        self.flush_timeout_seconds = flush_timeout_seconds
+        self._queue: asyncio.Queue[tuple[str, str, Dict[str, Any], datetime]] = asyncio.Queue()
+        self._worker_task: Optional[asyncio.Task] = None
+        # Очередь FIFO: число поставленных и обработанных событий задает позицию для flush()
+        self._submitted = 0
+        self._processed = 0
+        self._batch_done = asyncio.Event()
+
+    @property
+    def is_running(self) -> bool:
+        return self._worker_task is not None
+
+    def start(self) -> None:
+        if self._worker_task is None:
+            self._worker_task = asyncio.create_task(self._run())
+            # Если воркер упадет, ожидающие flush() не должны висеть вечно
+            self._worker_task.add_done_callback(lambda _: self._batch_done.set())
+
+    async def stop(self) -> None:
+        worker = self._worker_task
+        if worker is None:
+            return
+        await self.flush()
+        worker.cancel()
+        with suppress(asyncio.CancelledError):
+            await worker
+        self._worker_task = None
+
+    def submit(self, task_id: str, event_type: str, payload: Dict[str, Any]) -> None:
+        # created_at фиксируем сразу: у всей пачки NOW() был бы одинаковым и порядок бы потерялся
+        self._queue.put_nowait((task_id, event_type, payload, db.now_utc()))
+        self._submitted += 1
+
+    async def flush(self) -> None:
+        """Ждет запись событий, поставленных до вызова; более поздние не задерживают читателя."""
+        target = self._submitted
+        try:
+            # Зависшее соединение не должно блокировать чтение событий и остановку сервиса
+            await asyncio.wait_for(self._wait_processed(target), self.flush_timeout_seconds)
+        except asyncio.TimeoutError:
+            logger.warning(
+                "Timed out after %.1fs waiting for %s task events to flush",
+                self.flush_timeout_seconds,
+                target - self._processed,
+            )
+
+    async def _wait_processed(self, target: int) -> None:
+        while self._processed < target:
+            worker = self._worker_task
+            if worker is None or worker.done():
+                return
+            batch_done = self._batch_done
+            await batch_done.wait()
+
+    async def _write_batch(self, batch: List[tuple[str, str, Dict[str, Any], datetime]]) -> None:
+        # Построчный повтор уже делает append_events_bulk; сюда долетает только отказ всех строк
+        try:
+            await db.append_events_bulk(batch)
+        except Exception:
+            logger.exception("Failed to flush %s task events", len(batch))
+
+    async def _run(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                await self._write_batch(batch)
+            finally:
+                self._processed += len(batch)
+                self._batch_done.set()
+                self._batch_done = asyncio.Event()
+            await asyncio.sleep(self.interval_seconds)
+
+
 rate_limiter = RateLimiter()
 task_governor = TaskGovernor(MAX_CONCURRENT_TASKS)
+event_flusher = EventFlusher()
 
 
 async def enforce_rate_limit(
@@ -1508,25 +1861,24 @@ async def check_quota_exceeded(owner_key_hash: Optional[str]) -> bool:
 
 
 def sanitize_zip_path(path: str) -> str:
-    normalized = path.replace("\\", "/").lstrip("/")
-    posix_path = PurePosixPath(normalized)
-    if posix_path.is_absolute() or ".." in posix_path.parts or not posix_path.parts:
+    # Та же нормализация, что у PurePosixPath (пустые и "." сегменты выкидываются), но без объектов
+    parts = [part for part in path.replace("\\", "/").split("/") if part and part != "."]
+    if not parts or ".." in parts:
         raise HTTPException(status_code=400, detail=f"Invalid file path: {path}")
-    return posix_path.as_posix()
+    return "/".join(parts)
 
 
 def load_container_from_file(task_id: str) -> Optional[Container]:
     if not get_file_persistence_setting():
         return None
     filepath = Path("data/tasks") / f"{task_id}.json"
-    if not filepath.exists():
-        return None
     try:
-        with filepath.open("r", encoding="utf-8") as file:
-            data = json.load(file)
-        container = Container.from_dict(data)
+        # Один read_bytes вместо exists() + open(): отсутствующий файл — обычный промах.
+        container = Container.from_dict(orjson.loads(filepath.read_bytes()))
         storage.containers[task_id] = container
         return container
+    except FileNotFoundError:
+        return None
     except Exception:
         logger.exception("Failed to load container from %s", filepath)
         return None
@@ -1638,18 +1990,41 @@ async def load_container_from_db(task_id: str) -> Optional[Container]:
     return container
 
 
+@lru_cache(maxsize=4096)
+def _guess_mime_for_suffixes(suffixes: str) -> Optional[str]:
+    return mimetypes.guess_type(f"x.{suffixes}")[0]
+
+
+def guess_mime_type(filepath: str) -> Optional[str]:
+    # MIME зависит только от расширений (".tar.gz" тоже), поэтому кэшируем по ним
+    _, _, suffixes = filepath.rpartition("/")[2].partition(".")
+    return _guess_mime_for_suffixes(suffixes) if suffixes else None
+
+
+def encode_file_content(content: Any) -> bytes:
+    if isinstance(content, bytes):
+        return content
+    if isinstance(content, (bytearray, memoryview)):
+        return bytes(content)
+    return str(content).encode("utf-8")
+
+
+def content_sha256(payload: bytes) -> str:
+    # Хэш файлов — контроль целостности, а не криптография; OpenSSL отпускает GIL на больших буферах
+    return hashlib.sha256(payload, usedforsecurity=False).hexdigest()
+
+
 def build_container_snapshot(container: Container) -> Dict[str, Any]:
-    file_entries = []
-    for filepath, content in container.files.items():
-        payload = content.encode("utf-8") if isinstance(content, str) else content
-        file_entries.append(
-            {
-                "path": filepath,
-                "sha256": hashlib.sha256(payload).hexdigest(),
-                "size_bytes": len(payload),
-                "mime_type": mimetypes.guess_type(filepath)[0],
-            }
-        )
+    file_entries = [
+        {
+            "path": filepath,
+            "sha256": content_sha256(payload),
+            "size_bytes": len(payload),
+            "mime_type": guess_mime_type(filepath),
+        }
+        for filepath, content in container.files.items()
+        for payload in (encode_file_content(content),)
+    ]
     return {
         "project_id": container.project_id,
         "state": container.state.value,
@@ -1676,7 +2051,7 @@ def build_file_record(content: Any) -> Dict[str, Any]:
         is_binary = False
     return {
         "content": text_content,
-        "sha256": hashlib.sha256(payload).hexdigest(),
+        "sha256": content_sha256(payload),
         "size_bytes": len(payload),
         "is_binary": is_binary,
     }
@@ -1724,15 +2099,10 @@ def collect_template_files(template_path: Path) -> Dict[str, Any]:
 
 
 def compute_template_hash(files: Dict[str, Any]) -> str:
-    digest = hashlib.sha256()
+    digest = hashlib.sha256(usedforsecurity=False)
     for path in sorted(files.keys()):
         digest.update(path.encode("utf-8"))
-        content = files[path]
-        if isinstance(content, (bytes, bytearray)):
-            payload = bytes(content)
-        else:
-            payload = str(content).encode("utf-8")
-        digest.update(payload)
+        digest.update(encode_file_content(files[path]))
     return digest.hexdigest()
 
 
@@ -1857,7 +2227,8 @@ class TaskWorkspace:
 
     def materialize(self, container: Container) -> None:
         self.ensure()
-        for filepath, content in container.files.items():
+        # Снимок списка: materialize выполняется в потоке, пока event loop может менять файлы
+        for filepath, content in list(container.files.items()):
             self.write_file(filepath, content)
 
     def collect_files(self) -> Dict[str, Any]:
@@ -1878,8 +2249,13 @@ class TaskWorkspace:
             files[str(relative_path.as_posix())] = content
         return files
 
-    def sync_to_container(self, container: Container) -> Dict[str, List[str]]:
-        workspace_files = self.collect_files()
+    def sync_to_container(
+        self,
+        container: Container,
+        workspace_files: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, List[str]]:
+        if workspace_files is None:
+            workspace_files = self.collect_files()
         existing_records = capture_baseline_files(container)
         changed: List[str] = []
         removed: List[str] = []
@@ -2118,10 +2494,11 @@ def get_tool_version(command: List[str]) -> Optional[str]:
 def get_requirements_hash() -> Dict[str, Optional[str]]:
     requirements_path = Path(__file__).resolve().parents[1] / "requirements.txt"
     if requirements_path.exists():
-        payload = requirements_path.read_bytes()
+        with requirements_path.open("rb") as file:
+            digest = hashlib.file_digest(file, "sha256")
         return {
             "requirements_path": str(requirements_path),
-            "requirements_sha256": hashlib.sha256(payload).hexdigest(),
+            "requirements_sha256": digest.hexdigest(),
             "pip_freeze_sha256": None,
         }
     result = subprocess.run(
@@ -2134,7 +2511,7 @@ def get_requirements_hash() -> Dict[str, Optional[str]]:
     return {
         "requirements_path": None,
         "requirements_sha256": None,
-        "pip_freeze_sha256": hashlib.sha256(output).hexdigest(),
+        "pip_freeze_sha256": content_sha256(output),
     }
 
 
@@ -2172,10 +2549,23 @@ def build_repro_manifest_payload(
     }
 
 
+# task_id -> дайджест последнего записанного снапшота; повторная запись того же состояния пропускается.
+# Экономится только upsert: сам снапшот с sha256 файлов все равно строится перед сравнением
+_snapshot_digests: ContainerCache = ContainerCache(maxsize=SNAPSHOT_DIGEST_CACHE_SIZE)
+
+
 async def persist_container_snapshot(task_id: str, container: Container) -> None:
     if not db.is_enabled():
         return
-    await db.upsert_container_snapshot(task_id, build_container_snapshot(container))
+    snapshot = build_container_snapshot(container)
+    digest = hashlib.blake2b(
+        orjson.dumps(snapshot, default=str, option=_ORJSON_OPTIONS),
+        digest_size=16,
+    ).digest()
+    if _snapshot_digests.get(task_id) == digest:
+        return
+    await db.upsert_container_snapshot(task_id, snapshot)
+    _snapshot_digests[task_id] = digest
 
 
 def build_file_payload(filepath: str, content: Any) -> Dict[str, Any]:
@@ -2184,14 +2574,14 @@ def build_file_payload(filepath: str, content: Any) -> Dict[str, Any]:
         content_text = None
         content_bytes = content
     else:
-        payload = str(content).encode("utf-8")
         content_text = str(content)
+        payload = content_text.encode("utf-8")
         content_bytes = None
     return {
         "payload": payload,
         "content": content_text,
         "content_bytes": content_bytes,
-        "mime_type": mimetypes.guess_type(filepath)[0],
+        "mime_type": guess_mime_type(filepath),
     }
 
 
@@ -2199,7 +2589,7 @@ async def persist_container_file(task_id: str, filepath: str, content: Any) -> N
     if not db.is_enabled():
         return
     file_data = build_file_payload(filepath, content)
-    sha256 = hashlib.sha256(file_data["payload"]).hexdigest()
+    sha256 = content_sha256(file_data["payload"])
     size_bytes = len(file_data["payload"])
     await db.upsert_task_file(
         task_id,
@@ -2214,11 +2604,66 @@ async def persist_container_file(task_id: str, filepath: str, content: Any) -> N
     )
 
 
+def build_file_rows(items: List[tuple[str, Any]]) -> List[Dict[str, Any]]:
+    rows = []
+    for filepath, content in items:
+        file_data = build_file_payload(filepath, content)
+        payload = file_data.pop("payload")
+        file_data["path"] = filepath
+        file_data["sha256"] = content_sha256(payload)
+        file_data["size_bytes"] = len(payload)
+        rows.append(file_data)
+    return rows
+
+
 async def persist_all_container_files(task_id: str, container: Container) -> None:
     if not db.is_enabled():
         return
-    for filepath, content in container.files.items():
-        await persist_container_file(task_id, filepath, content)
+    # Кодирование и хэши считаем вне event loop, в БД уходит один пакет вместо N запросов
+    rows = await asyncio.to_thread(build_file_rows, list(container.files.items()))
+    await db.bulk_upsert_task_files(
+        task_id,
+        rows,
+        max_bytes=MAX_TASK_BYTES,
+        max_files=MAX_TASK_FILES,
+    )
+
+
+async def gather_side_effects(*awaitables: Any) -> None:
+    """Параллельно выполняет независимые вызовы сохранения; первая ошибка пробрасывается после завершения всех"""
+    results = await asyncio.gather(*awaitables, return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    for error in errors:
+        logger.error("Persistence side effect failed: %r", error)
+    if errors:
+        raise errors[0]
+
+
+class ZipChunkWriter:
+    """Write-only sink for zipfile that hands out the bytes written so far."""
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        chunk = bytes(self._buffer)
+        self._buffer.clear()
+        return chunk
+
+
+def iter_file_chunks(file: IO[bytes], chunk_size: int = ZIP_WRITE_CHUNK_SIZE):
+    try:
+        while chunk := file.read(chunk_size):
+            yield chunk
+    finally:
+        file.close()
 
 
 async def build_zip_response(task_id: str, request: Request) -> StreamingResponse:
@@ -2254,52 +2699,75 @@ async def build_zip_response(task_id: str, request: Request) -> StreamingRespons
     iterations = container.metadata.get("iterations") or 0
     api_base_url = str(request.base_url).rstrip("/")
 
-    buffer = io.BytesIO()
-    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
-        root_info = zipfile.ZipInfo(root_folder)
-        root_info.flag_bits |= 0x800  # UTF-8 filenames
-        root_info.date_time = zip_timestamp
-        root_info.external_attr = 0o40775 << 16
-        zip_file.writestr(root_info, b"")
+    # Пути проверяем до начала стрима: после первого байта статус ответа уже не поменять
+    entries = [
+        (sanitize_zip_path(filepath), content) for filepath, content in container.files.items()
+    ]
 
-        for filepath, content in container.files.items():
-            safe_path = sanitize_zip_path(filepath)
-            payload = content.encode("utf-8") if isinstance(content, str) else content
-            files_manifest.append(
-                {
-                    "path": safe_path,
-                    "size": len(payload),
-                    "sha256": hashlib.sha256(payload).hexdigest(),
-                }
+    def generate_zip():
+        writer = ZipChunkWriter()
+        with zipfile.ZipFile(writer, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+            root_info = zipfile.ZipInfo(root_folder)
+            root_info.flag_bits |= 0x800  # UTF-8 filenames
+            root_info.date_time = zip_timestamp
+            root_info.external_attr = 0o40775 << 16
+            zip_file.writestr(root_info, b"")
+
+            for safe_path, content in entries:
+                payload = encode_file_content(content)
+                files_manifest.append(
+                    {
+                        "path": safe_path,
+                        "size": len(payload),
+                        "sha256": content_sha256(payload),
+                    }
+                )
+                archive_path = f"{root_folder}{safe_path}"
+                zip_info = zipfile.ZipInfo(archive_path)
+                zip_info.flag_bits |= 0x800  # UTF-8 filenames
+                zip_info.date_time = zip_timestamp
+                # Для ZipInfo настройки сжатия ZipFile не применяются — задаём их явно
+                zip_info.compress_type = zip_compress_type(safe_path)
+                zip_info._compresslevel = ZIP_COMPRESS_LEVEL
+                zip_info.file_size = len(payload)
+                # Большие файлы пишем кусками и отдаём сжатые данные сразу,
+                # чтобы не держать в памяти весь сжатый файл рядом с исходным
+                view = memoryview(payload)
+                with zip_file.open(zip_info, "w") as dest:
+                    for offset in range(0, len(view), ZIP_WRITE_CHUNK_SIZE):
+                        dest.write(view[offset:offset + ZIP_WRITE_CHUNK_SIZE])
+                        chunk = writer.drain()
+                        if chunk:
+                            yield chunk
+                yield writer.drain()
+
+            manifest_payload = {
+                "task_id": task_id,
+                "status": task_data.get("status"),
+                "created_at": to_iso_string(task_data.get("created_at") or container.created_at),
+                "updated_at": to_iso_string(task_data.get("updated_at") or container.updated_at),
+                "iterations": iterations,
+                "files_count": files_count,
+                "artifacts_count": artifacts_count,
+                "api_base_url": api_base_url,
+                "files": files_manifest,
+            }
+            manifest_bytes = orjson.dumps(manifest_payload, option=orjson.OPT_INDENT_2)
+            manifest_info = zipfile.ZipInfo(f"{root_folder}manifest.json")
+            manifest_info.flag_bits |= 0x800  # UTF-8 filenames
+            manifest_info.date_time = zip_timestamp
+            zip_file.writestr(
+                manifest_info,
+                manifest_bytes,
+                compress_type=zip_compress_type("manifest.json"),
+                compresslevel=ZIP_COMPRESS_LEVEL,
             )
-            archive_path = f"{root_folder}{safe_path}"
-            zip_info = zipfile.ZipInfo(archive_path)
-            zip_info.flag_bits |= 0x800  # UTF-8 filenames
-            zip_info.date_time = zip_timestamp
-            zip_file.writestr(zip_info, payload)
-
-        manifest_payload = {
-            "task_id": task_id,
-            "status": task_data.get("status"),
-            "created_at": to_iso_string(task_data.get("created_at") or container.created_at),
-            "updated_at": to_iso_string(task_data.get("updated_at") or container.updated_at),
-            "iterations": iterations,
-            "files_count": files_count,
-            "artifacts_count": artifacts_count,
-            "api_base_url": api_base_url,
-            "files": files_manifest,
-        }
-        manifest_bytes = json.dumps(manifest_payload, ensure_ascii=False, indent=2).encode("utf-8")
-        manifest_info = zipfile.ZipInfo(f"{root_folder}manifest.json")
-        manifest_info.flag_bits |= 0x800  # UTF-8 filenames
-        manifest_info.date_time = zip_timestamp
-        zip_file.writestr(manifest_info, manifest_bytes)
+        yield writer.drain()
 
-    buffer.seek(0)
     headers = {
         "Content-Disposition": f'attachment; filename="task_{task_id}.zip"'
     }
-    return StreamingResponse(buffer, media_type="application/zip", headers=headers)
+    return StreamingResponse(generate_zip(), media_type="application/zip", headers=headers)
 
 
 async def build_git_export_zip_response(task_id: str, request: Request) -> StreamingResponse:
@@ -2332,7 +2800,8 @@ async def build_git_export_zip_response(task_id: str, request: Request) -> Strea
     git_export_files = build_git_export_files(task_id, patch_payload)
 
     root_folder = f"task_{task_id}/git_export/"
-    buffer = io.BytesIO()
+    # Небольшие архивы остаются в памяти, большие уходят на диск без перекопирования BytesIO
+    buffer = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_BYTES)
     with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
         root_info = zipfile.ZipInfo(root_folder)
         root_info.flag_bits |= 0x800  # UTF-8 filenames
@@ -2347,14 +2816,19 @@ async def build_git_export_zip_response(task_id: str, request: Request) -> Strea
             zip_info.date_time = zip_timestamp
             if filename == "apply.sh":
                 zip_info.external_attr = 0o100755 << 16
-            payload = content.encode("utf-8") if isinstance(content, str) else content
-            zip_file.writestr(zip_info, payload)
+            payload = encode_file_content(content)
+            zip_file.writestr(
+                zip_info,
+                payload,
+                compress_type=zip_compress_type(filename),
+                compresslevel=ZIP_COMPRESS_LEVEL,
+            )
 
     buffer.seek(0)
     headers = {
         "Content-Disposition": f'attachment; filename="task_{task_id}_git_export.zip"'
     }
-    return StreamingResponse(buffer, media_type="application/zip", headers=headers)
+    return StreamingResponse(iter_file_chunks(buffer), media_type="application/zip", headers=headers)
 
 # CORS для Telegram Mini App и локальной разработки
 app.add_middleware(
@@ -2417,7 +2891,7 @@ async def health_check():
         "status": "healthy",
         "timestamp": asyncio.get_event_loop().time(),
         "active_tasks": len(storage.active_tasks),
-        "active_connections": len(manager.active_connections),
+        "active_connections": manager.connection_count(),
     }
 
 
@@ -2531,6 +3005,20 @@ async def ops_status():
         }
 
 
+@app.post("/admin/reload")
+async def admin_reload(request: Request):
+    """Drop cached settings so env changes apply without a restart (admin only)."""
+    await require_admin_auth(request)
+    try:
+        reload_llm_settings()
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    get_auth_settings.cache_clear()
+    get_google_oauth_settings.cache_clear()
+    logger.info("Settings caches reloaded")
+    return {"reloaded": ["llm", "auth", "google_oauth"]}
+
+
 @app.get("/ops/templates")
 async def ops_templates(request: Request):
     """Operational templates endpoint (auth required)."""
@@ -2730,7 +3218,7 @@ async def list_project_tasks(project_id: str, req: Request):
         if project is None:
             raise HTTPException(status_code=404, detail="Project not found")
         tasks = await db.list_tasks_for_project(project_id, owner_user_id)
-        tasks = [enrich_task_data(str(task["id"]), task) for task in tasks]
+        tasks = enrich_task_rows(tasks)
     else:
         project = storage.projects.get(project_id)
         if project is None or project.get("owner_user_id") != owner_user_id:
@@ -2847,23 +3335,21 @@ async def create_task(request: TaskRequest, req: Request):
                 "can_start": can_start,
             }
             
-            # Сохраняем связь пользователь -> задача
-            if user_id not in storage.user_sessions:
-                storage.user_sessions[user_id] = []
-            storage.user_sessions[user_id].append(task_id)
+            # Сохраняем связь пользователь -> задача; старые записи вытесняются
+            storage.user_sessions.setdefault(
+                user_id, deque(maxlen=USER_SESSION_MAX_TASKS)
+            ).append(task_id)
 
         await record_event(
             task_id,
             "TaskCreated",
-            normalize_payload(
-                {
-                    "user_id": user_id,
-                    "codex_version": request.codex_version,
-                    "template_id": template_id,
-                    "template_hash": template_hash,
-                    "project_id": project_id,
-                }
-            ),
+            {
+                "user_id": user_id,
+                "codex_version": request.codex_version,
+                "template_id": template_id,
+                "template_hash": template_hash,
+                "project_id": project_id,
+            },
         )
         await record_state(
             task_id,
@@ -2955,13 +3441,13 @@ async def start_task_intake(task_id: str, request: Request):
                 await record_artifact(
                     task_id,
                     "research_chat",
-                    normalize_payload(assistant_payload),
+                    assistant_payload,
                     produced_by="assistant",
                 )
                 await record_event(
                     task_id,
                     "chat_message",
-                    normalize_payload(assistant_payload),
+                    assistant_payload,
                 )
 
         update_fields = {
@@ -3325,7 +3811,7 @@ async def submit_task_input(task_id: str, payload: TaskInputRequest, request: Re
         await record_event(
             task_id,
             "clarification_received",
-            normalize_payload({"answers": merged_answers, "received_at": db.now_utc().isoformat()}),
+            {"answers": merged_answers, "received_at": db.now_utc().isoformat()},
         )
         if payload.auto_resume:
             return await resume_task(task_id, request)
@@ -3366,13 +3852,13 @@ async def submit_task_chat(task_id: str, payload: ChatMessageRequest, request: R
         await record_artifact(
             task_id,
             "research_chat",
-            normalize_payload(chat_payload),
+            chat_payload,
             produced_by="user",
         )
         await record_event(
             task_id,
             "chat_message",
-            normalize_payload(chat_payload),
+            chat_payload,
         )
         await persist_container_snapshot(task_id, container)
 
@@ -3400,26 +3886,26 @@ async def submit_task_chat(task_id: str, payload: ChatMessageRequest, request: R
                 await record_artifact(
                     task_id,
                     "research_chat",
-                    normalize_payload(assistant_payload),
+                    assistant_payload,
                     produced_by="assistant",
                 )
                 await record_event(
                     task_id,
                     "chat_message",
-                    normalize_payload(assistant_payload),
+                    assistant_payload,
                 )
         else:
             requirements = interviewer_result if isinstance(interviewer_result, dict) else {}
             await record_artifact(
                 task_id,
                 "requirements",
-                normalize_payload(requirements),
+                requirements,
                 produced_by="interviewer",
             )
             await record_event(
                 task_id,
                 "ArtifactAdded",
-                normalize_payload({"type": "requirements"}),
+                {"type": "requirements"},
             )
             await persist_all_container_files(task_id, container)
             updated_status = "intake_complete"
@@ -3482,7 +3968,7 @@ async def resume_task(task_id: str, request: Request):
         await record_event(
             task_id,
             "task_resumed",
-            normalize_payload({"resume_from_stage": resume_stage, "resumed_at": db.now_utc().isoformat()}),
+            {"resume_from_stage": resume_stage, "resumed_at": db.now_utc().isoformat()},
         )
         if db.is_enabled():
             await db.update_task_row(
@@ -3547,13 +4033,11 @@ async def apply_manual_step(task_id: str, payload: TaskManualStepRequest, reques
         await record_event(
             task_id,
             "manual_step_received",
-            normalize_payload(
-                {
-                    "decision": decision,
-                    "note": payload.note,
-                    "received_at": db.now_utc().isoformat(),
-                }
-            ),
+            {
+                "decision": decision,
+                "note": payload.note,
+                "received_at": db.now_utc().isoformat(),
+            },
         )
         manual_step_stage = task_data.get("manual_step_stage")
         resume_phase = task_data.get("resume_phase") or task_data.get("resume_from_stage") or "implementation"
@@ -3566,7 +4050,7 @@ async def apply_manual_step(task_id: str, payload: TaskManualStepRequest, reques
             await record_event(
                 task_id,
                 "manual_step_applied",
-                normalize_payload({"decision": decision, "applied_at": completed_at.isoformat()}),
+                {"decision": decision, "applied_at": completed_at.isoformat()},
             )
             update_fields = {
                 "status": "failed",
@@ -3611,7 +4095,7 @@ async def apply_manual_step(task_id: str, payload: TaskManualStepRequest, reques
         await record_event(
             task_id,
             "manual_step_applied",
-            normalize_payload({"decision": decision, "applied_at": db.now_utc().isoformat()}),
+            {"decision": decision, "applied_at": db.now_utc().isoformat()},
         )
         update_fields = {
             "status": "queued",
@@ -3690,8 +4174,9 @@ async def get_task_events(task_id: str, request: Request, limit: int = 200, orde
     task_token = set_task_id(task_id)
     try:
         normalized_order = validate_order(order)
-        await ensure_task_owner(task_id, request)
+        await ensure_task_access(task_id, request)
         if db.is_enabled():
+            await event_flusher.flush()
             events = await db.get_events(task_id, limit=limit, order=normalized_order)
         else:
             ensure_task_exists_in_memory(task_id)
@@ -3717,7 +4202,7 @@ async def get_task_artifacts(
     task_token = set_task_id(task_id)
     try:
         normalized_order = validate_order(order)
-        await ensure_task_owner(task_id, request)
+        await ensure_task_access(task_id, request)
         if db.is_enabled():
             artifacts = await db.get_artifacts(task_id, type=type, limit=limit, order=normalized_order)
         else:
@@ -3738,7 +4223,7 @@ async def get_task_state(task_id: str, request: Request):
     """Получение состояния контейнера"""
     task_token = set_task_id(task_id)
     try:
-        await ensure_task_owner(task_id, request)
+        await ensure_task_access(task_id, request)
         if db.is_enabled():
             state_row = await db.get_container_state(task_id)
         else:
@@ -3752,37 +4237,43 @@ async def get_task_state(task_id: str, request: Request):
     finally:
         reset_task_id(task_token)
 
+FILE_DECODE_OFFLOAD_BYTES = 64 * 1024
+# Подстроки, а не суффиксы: "settings.json.bak" тоже считается конфигом
+CONFIG_FILE_PATTERN = re.compile(r"\.json|\.yaml|\.yml|\.toml|\.env")
+DOC_FILE_PATTERN = re.compile(r"\.md|\.txt|\.rst")
+KNOWN_FILE_PATTERN = re.compile(r"\.py|\.json|\.yaml|\.md|test")
+
+
 @app.get("/api/tasks/{task_id}/files")
 async def get_task_files(task_id: str, request: Request):
     """Получение списка файлов задачи"""
     task_token = set_task_id(task_id)
     container = None
     try:
-        await ensure_task_owner(task_id, request)
+        await ensure_task_access(task_id, request)
         container = await resolve_container_with_db(task_id)
         if not container:
             raise HTTPException(status_code=404, detail="Container not found")
 
-        # Группируем файлы по типам
-        files_by_type = {
-            "code": [f for f in container.files.keys() if f.endswith(".py")],
-            "config": [
-                f
-                for f in container.files.keys()
-                if any(ext in f for ext in [".json", ".yaml", ".yml", ".toml", ".env"])
-            ],
-            "docs": [
-                f
-                for f in container.files.keys()
-                if any(ext in f for ext in [".md", ".txt", ".rst"])
-            ],
-            "tests": [f for f in container.files.keys() if "test" in f.lower()],
-            "other": [
-                f
-                for f in container.files.keys()
-                if not any(pattern in f for pattern in [".py", ".json", ".yaml", ".md", "test"])
-            ],
+        # Группируем файлы по типам за один проход; файл может попасть в несколько групп
+        files_by_type: Dict[str, List[str]] = {
+            "code": [],
+            "config": [],
+            "docs": [],
+            "tests": [],
+            "other": [],
         }
+        for f in container.files:
+            if f.endswith(".py"):
+                files_by_type["code"].append(f)
+            if CONFIG_FILE_PATTERN.search(f):
+                files_by_type["config"].append(f)
+            if DOC_FILE_PATTERN.search(f):
+                files_by_type["docs"].append(f)
+            if "test" in f.lower():
+                files_by_type["tests"].append(f)
+            if not KNOWN_FILE_PATTERN.search(f):
+                files_by_type["other"].append(f)
 
         return {
             "total": len(container.files),
@@ -3794,7 +4285,7 @@ async def get_task_files(task_id: str, request: Request):
         await record_event(
             task_id,
             "TaskFilesError",
-            normalize_payload({"error": str(exc)}),
+            {"error": str(exc)},
         )
         return {
             "total": len(container.files) if container else 0,
@@ -3809,24 +4300,29 @@ async def get_file_content(task_id: str, filepath: str, request: Request):
     """Получение содержимого файла"""
     task_token = set_task_id(task_id)
     try:
-        await ensure_task_owner(task_id, request)
+        await ensure_task_access(task_id, request)
         container = await resolve_container_with_db(task_id)
         if not container:
             raise HTTPException(status_code=404, detail="Container not found")
 
-        # Ищем файл (с учетом возможных путей)
-        actual_path = None
-        for stored_path in container.files.keys():
-            if stored_path.endswith(filepath) or filepath in stored_path:
-                actual_path = stored_path
-                break
-
-        if not actual_path or actual_path not in container.files:
+        # Сначала точное совпадение, затем поиск по вхождению (с учетом возможных путей)
+        if filepath in container.files:
+            actual_path = filepath
+        else:
+            actual_path = next(
+                (stored_path for stored_path in container.files if filepath in stored_path),
+                None,
+            )
+        if actual_path is None:
             raise HTTPException(status_code=404, detail="File not found")
 
         content = container.files[actual_path]
         if isinstance(content, bytes):
-            content = content.decode("utf-8", errors="replace")
+            if len(content) > FILE_DECODE_OFFLOAD_BYTES:
+                # Крупные файлы декодируем вне event loop, чтобы не задерживать остальные запросы
+                content = await asyncio.to_thread(content.decode, "utf-8", "replace")
+            else:
+                content = content.decode("utf-8", errors="replace")
 
         return {
             "path": actual_path,
@@ -3848,7 +4344,7 @@ async def download_task_files(task_id: str, request: Request):
             "download",
             RATE_LIMIT_DOWNLOADS_PER_MIN,
         )
-        await ensure_task_owner(task_id, request)
+        await ensure_task_access(task_id, request)
         return await build_zip_response(task_id, request)
     finally:
         reset_task_id(task_token)
@@ -3865,7 +4361,7 @@ async def download_task_files_get(task_id: str, request: Request):
             "download",
             RATE_LIMIT_DOWNLOADS_PER_MIN,
         )
-        await ensure_task_owner(task_id, request)
+        await ensure_task_access(task_id, request)
         return await build_zip_response(task_id, request)
     finally:
         reset_task_id(task_token)
@@ -3882,7 +4378,7 @@ async def download_git_export(task_id: str, request: Request):
             "download",
             RATE_LIMIT_DOWNLOADS_PER_MIN,
         )
-        await ensure_task_owner(task_id, request)
+        await ensure_task_access(task_id, request)
         return await build_git_export_zip_response(task_id, request)
     finally:
         reset_task_id(task_token)
@@ -3898,7 +4394,7 @@ async def get_user_tasks(user_id: str, request: Request, limit: int = 10):
             raise HTTPException(status_code=403, detail="Forbidden")
         if db.is_enabled():
             tasks = await db.list_tasks_for_owner_user(owner_user_id, owner_key_hash, limit)
-            tasks = [enrich_task_data(str(task["id"]), task) for task in tasks]
+            tasks = enrich_task_rows(tasks)
             return {
                 "user_id": user_id,
                 "tasks": tasks,
@@ -3924,7 +4420,7 @@ async def get_user_tasks(user_id: str, request: Request, limit: int = 10):
 
     if db.is_enabled():
         tasks = await db.list_tasks_for_owner_key(owner_key_hash, limit, user_id=user_id)
-        tasks = [enrich_task_data(str(task["id"]), task) for task in tasks]
+        tasks = enrich_task_rows(tasks)
         return {
             "user_id": user_id,
             "tasks": tasks,
@@ -3935,7 +4431,7 @@ async def get_user_tasks(user_id: str, request: Request, limit: int = 10):
     if user_id not in storage.user_sessions:
         return {"tasks": [], "total": 0}
 
-    task_ids = storage.user_sessions[user_id][-limit:]  # Последние N задач
+    task_ids = list(storage.user_sessions[user_id])[-limit:]  # Последние N задач
     tasks = [
         storage.active_tasks[task_id]
         for task_id in task_ids
@@ -3979,10 +4475,10 @@ async def websocket_endpoint(websocket: WebSocket, task_id: str):
                     
         except WebSocketDisconnect:
             logger.info("WebSocket disconnected for task_id=%s", task_id)
-            manager.disconnect(task_id)
+            manager.disconnect(task_id, websocket)
         except Exception as e:
             logger.error("WebSocket error for task_id=%s: %s", task_id, e)
-            manager.disconnect(task_id)
+            manager.disconnect(task_id, websocket)
     finally:
         reset_task_id(task_token)
 
@@ -4004,11 +4500,18 @@ async def process_task_background(
             if db.is_enabled():
                 task_data = await db.update_task_row(task_id, fields)
                 if task_data:
-                    await manager.send_progress(task_id, enrich_task_data(task_id, task_data))
+                    # Обогащаем один раз на окно debounce, а не на каждое обновление
+                    manager.schedule_progress(task_id, lambda: enrich_task_data(task_id, task_data))
             else:
                 fields.setdefault("updated_at", db.now_utc())
                 storage.active_tasks[task_id].update(fields)
-                await manager.send_progress(task_id, storage.active_tasks[task_id])
+                manager.schedule_progress(task_id, lambda: storage.active_tasks.get(task_id))
+            status = fields.get("status")
+            if status in {"completed", "failed", "error", "awaiting_user", "needs_input"}:
+                # Финальный кадр прогресса должен попасть в журнал раньше TaskCompleted/TaskFailed
+                await manager.flush_progress(task_id)
+            if status in {"completed", "failed", "error"}:
+                _snapshot_digests.pop(task_id, None)
 
         task_data = await db.get_task_row(task_id) if db.is_enabled() else storage.active_tasks.get(task_id)
         if not task_data:
@@ -4030,16 +4533,15 @@ async def process_task_background(
 
         async def fail_quota_exceeded() -> None:
             completed_at = db.now_utc()
+            await manager.flush_progress(task_id)
             await record_event(
                 task_id,
                 "stage_failed",
-                normalize_payload(
-                    {
-                        "stage": "initializing",
-                        "reason": "quota_exceeded",
-                        "status": "failed",
-                    }
-                ),
+                {
+                    "stage": "initializing",
+                    "reason": "quota_exceeded",
+                    "status": "failed",
+                },
             )
             await apply_task_update(
                 {
@@ -4054,7 +4556,7 @@ async def process_task_background(
             await record_event(
                 task_id,
                 "TaskFailed",
-                normalize_payload({"error": "quota_exceeded"}),
+                {"error": "quota_exceeded"},
             )
             await record_state(
                 task_id,
@@ -4080,7 +4582,7 @@ async def process_task_background(
         await record_event(
             task_id,
             "StageStarted",
-            normalize_payload({"stage": "initializing"}),
+            {"stage": "initializing"},
         )
         await record_state(
             task_id,
@@ -4112,7 +4614,7 @@ async def process_task_background(
             orchestrator.attach_container(container)
 
         workspace = TaskWorkspace(task_id, WORKSPACE_ROOT)
-        workspace.materialize(container)
+        await asyncio.to_thread(workspace.materialize, container)
         container.metadata["workspace_path"] = str(workspace.path)
         container.metadata["owner_key_hash"] = owner_key_hash
         if owner_user_id:
@@ -4151,7 +4653,7 @@ async def process_task_background(
             await record_event(
                 task_id,
                 "StageStarted",
-                normalize_payload({"stage": stage}),
+                {"stage": stage},
             )
             await record_state(
                 task_id,
@@ -4167,48 +4669,52 @@ async def process_task_background(
 
         async def handle_research_complete(payload: Dict[str, Any]) -> None:
             result = payload.get("result")
-            await record_artifact(
-                task_id,
-                "research_summary",
-                normalize_payload(result),
-                produced_by="researcher",
-            )
-            await record_event(
-                task_id,
-                "ArtifactAdded",
-                normalize_payload({"type": "research_summary"}),
+            await gather_side_effects(
+                record_artifact(
+                    task_id,
+                    "research_summary",
+                    result,
+                    produced_by="researcher",
+                ),
+                record_event(
+                    task_id,
+                    "ArtifactAdded",
+                    {"type": "research_summary"},
+                ),
+                persist_all_container_files(task_id, container),
+                persist_container_snapshot(task_id, container),
             )
-            await persist_all_container_files(task_id, container)
-            await persist_container_snapshot(task_id, container)
 
         async def handle_design_complete(payload: Dict[str, Any]) -> None:
             result = payload.get("result")
-            await record_artifact(
-                task_id,
-                "architecture",
-                normalize_payload(result),
-                produced_by="designer",
-            )
-            await record_event(
-                task_id,
-                "ArtifactAdded",
-                normalize_payload({"type": "architecture"}),
+            await gather_side_effects(
+                record_artifact(
+                    task_id,
+                    "architecture",
+                    result,
+                    produced_by="designer",
+                ),
+                record_event(
+                    task_id,
+                    "ArtifactAdded",
+                    {"type": "architecture"},
+                ),
+                persist_all_container_files(task_id, container),
+                persist_container_snapshot(task_id, container),
             )
-            await persist_all_container_files(task_id, container)
-            await persist_container_snapshot(task_id, container)
 
         async def handle_planning_complete(payload: Dict[str, Any]) -> None:
             result = payload.get("result")
             await record_artifact(
                 task_id,
                 "implementation_plan",
-                normalize_payload(result),
+                result,
                 produced_by="planner",
             )
             await record_event(
                 task_id,
                 "ArtifactAdded",
-                normalize_payload({"type": "implementation_plan"}),
+                {"type": "implementation_plan"},
             )
             await persist_container_snapshot(task_id, container)
 
@@ -4216,11 +4722,13 @@ async def process_task_background(
             await record_event(
                 task_id,
                 "review_started",
-                normalize_payload(payload),
+                payload,
             )
 
         async def handle_coder_finished(payload: Dict[str, Any]) -> None:
-            sync_result = workspace.sync_to_container(container)
+            # Чтение воркспейса — блокирующий обход диска, выносим его в поток
+            workspace_files = await asyncio.to_thread(workspace.collect_files)
+            sync_result = workspace.sync_to_container(container, workspace_files)
             changed_files = sync_result.get("changed", [])
             removed_files = sync_result.get("removed", [])
             for path in changed_files:
@@ -4237,14 +4745,12 @@ async def process_task_background(
             await record_event(
                 task_id,
                 "review_finished",
-                normalize_payload(
-                    {
-                        "kind": payload.get("kind") if isinstance(payload, dict) else None,
-                        "iteration": payload.get("iteration") if isinstance(payload, dict) else None,
-                        "passed": result.get("passed") if isinstance(result, dict) else None,
-                        "status": result.get("status") if isinstance(result, dict) else None,
-                    }
-                ),
+                {
+                    "kind": payload.get("kind") if isinstance(payload, dict) else None,
+                    "iteration": payload.get("iteration") if isinstance(payload, dict) else None,
+                    "passed": result.get("passed") if isinstance(result, dict) else None,
+                    "status": result.get("status") if isinstance(result, dict) else None,
+                },
             )
 
         async def handle_review_result(payload: Dict[str, Any]) -> None:
@@ -4252,26 +4758,27 @@ async def process_task_background(
             artifact_id = await record_artifact(
                 task_id,
                 "review_report",
-                normalize_payload(result),
+                result,
                 produced_by="reviewer",
             )
             if artifact_id:
                 container.metadata["last_review_report_artifact_id"] = artifact_id
             issues = result.get("issues") if isinstance(result, dict) else None
             issues_count = len(issues) if isinstance(issues, list) else 0
-            await record_event(
-                task_id,
-                "ReviewResult",
-                normalize_payload(
+            # Артефакт сохраняем первым: его id попадает в metadata снапшота
+            await gather_side_effects(
+                record_event(
+                    task_id,
+                    "ReviewResult",
                     {
                         "status": result.get("status") if isinstance(result, dict) else None,
                         "issues_count": issues_count,
                         "kind": payload.get("kind"),
-                    }
+                    },
                 ),
+                persist_all_container_files(task_id, container),
+                persist_container_snapshot(task_id, container),
             )
-            await persist_all_container_files(task_id, container)
-            await persist_container_snapshot(task_id, container)
 
         async def handle_next_actions(payload: Dict[str, Any]) -> None:
             actions_payload = payload.get("payload") if isinstance(payload, dict) else None
@@ -4280,13 +4787,13 @@ async def process_task_background(
             await record_artifact(
                 task_id,
                 "next_actions",
-                normalize_payload(actions_payload),
+                actions_payload,
                 produced_by="orchestrator",
             )
             await record_event(
                 task_id,
                 "next_actions_created",
-                normalize_payload({"stage": actions_payload.get("stage")}),
+                {"stage": actions_payload.get("stage")},
             )
             await persist_container_snapshot(task_id, container)
 
@@ -4294,21 +4801,21 @@ async def process_task_background(
             await record_event(
                 task_id,
                 "PlanStepStarted",
-                normalize_payload(payload),
+                payload,
             )
 
         async def handle_plan_step_finished(payload: Dict[str, Any]) -> None:
             await record_event(
                 task_id,
                 "PlanStepFinished",
-                normalize_payload(payload),
+                payload,
             )
 
         async def handle_codex_loaded(payload: Dict[str, Any]) -> None:
             await record_event(
                 task_id,
                 "codex_loaded",
-                normalize_payload(payload),
+                payload,
             )
 
         async def handle_llm_usage(payload: Dict[str, Any]) -> None:
@@ -4316,7 +4823,7 @@ async def process_task_background(
             await record_event(
                 task_id,
                 "llm_usage",
-                normalize_payload(usage or {}),
+                usage or {},
             )
             if isinstance(usage, dict):
                 tokens_in = int(usage.get("tokens_in") or usage.get("input_tokens") or 0)
@@ -4327,13 +4834,13 @@ async def process_task_background(
                 await record_artifact(
                     task_id,
                     "usage_report",
-                    normalize_payload(usage_report),
+                    usage_report,
                     produced_by="coder",
                 )
                 await record_event(
                     task_id,
                     "ArtifactAdded",
-                    normalize_payload({"type": "usage_report"}),
+                    {"type": "usage_report"},
                 )
             await record_state(
                 task_id,
@@ -4352,7 +4859,7 @@ async def process_task_background(
             await record_event(
                 task_id,
                 "llm_error",
-                normalize_payload(payload),
+                payload,
             )
 
         async def handle_stage_failed(payload: Dict[str, Any]) -> None:
@@ -4361,17 +4868,16 @@ async def process_task_background(
             error = payload.get("error") if isinstance(payload, dict) else None
             failure_context["stage"] = stage or failure_context["stage"]
             failure_context["reason"] = reason or error or failure_context["reason"]
+            await manager.flush_progress(task_id)
             await record_event(
                 task_id,
                 "stage_failed",
-                normalize_payload(
-                    {
-                        "stage": stage,
-                        "reason": reason,
-                        "error": error,
-                        "status": "failed",
-                    }
-                ),
+                {
+                    "stage": stage,
+                    "reason": reason,
+                    "error": error,
+                    "status": "failed",
+                },
             )
 
         async def handle_clarification_requested(payload: Dict[str, Any]) -> None:
@@ -4385,19 +4891,17 @@ async def process_task_background(
             await record_artifact(
                 task_id,
                 "clarification_questions",
-                normalize_payload(artifact_payload),
+                artifact_payload,
                 produced_by="planner",
             )
             await record_event(
                 task_id,
                 "clarification_requested",
-                normalize_payload(
-                    {
-                        "questions": questions,
-                        "requested_at": requested_at,
-                        "resume_from_stage": resume_stage_payload,
-                    }
-                ),
+                {
+                    "questions": questions,
+                    "requested_at": requested_at,
+                    "resume_from_stage": resume_stage_payload,
+                },
             )
             await persist_container_snapshot(task_id, container)
 
@@ -4484,13 +4988,11 @@ async def process_task_background(
                 await record_event(
                     task_id,
                     "manual_step_requested",
-                    normalize_payload(
-                        {
-                            "manual_step_stage": manual_stage,
-                            "resume_phase": resume_phase,
-                            "resume_iteration": resume_iteration,
-                        }
-                    ),
+                    {
+                        "manual_step_stage": manual_stage,
+                        "resume_phase": resume_phase,
+                        "resume_iteration": resume_iteration,
+                    },
                 )
                 await apply_task_update(
                     {
@@ -4565,13 +5067,13 @@ async def process_task_background(
         await record_artifact(
             task_id,
             "patch_diff",
-            normalize_payload(patch_payload),
+            patch_payload,
             produced_by="system",
         )
         await record_event(
             task_id,
             "ArtifactAdded",
-            normalize_payload({"type": "patch_diff"}),
+            {"type": "patch_diff"},
         )
 
         git_export_payload = build_git_export_payload(task_id, patch_payload)
@@ -4579,13 +5081,13 @@ async def process_task_background(
         await record_artifact(
             task_id,
             "git_export",
-            normalize_payload(git_export_payload),
+            git_export_payload,
             produced_by="system",
         )
         await record_event(
             task_id,
             "ArtifactAdded",
-            normalize_payload({"type": "git_export"}),
+            {"type": "git_export"},
         )
 
         completed_at = db.now_utc()
@@ -4608,17 +5110,20 @@ async def process_task_background(
         await record_artifact(
             task_id,
             "repro_manifest",
-            normalize_payload(manifest_payload),
+            manifest_payload,
             produced_by="system",
         )
         await record_event(
             task_id,
             "ArtifactAdded",
-            normalize_payload({"type": "repro_manifest"}),
+            {"type": "repro_manifest"},
         )
         
-        # Сохраняем контейнер в файл (для persistence)
-        save_container_to_file(task_id, container)
+        # Сохраняем контейнер в файл (для persistence) вне event loop
+        if get_file_persistence_setting():
+            # to_dict обходит живые files/artifacts/history, поэтому строим снимок в цикле событий,
+            # а в поток уходят только сериализация и запись
+            await asyncio.to_thread(write_container_file, task_id, container.to_dict())
         await persist_all_container_files(task_id, container)
         await persist_container_snapshot(task_id, container)
         
@@ -4635,16 +5140,15 @@ async def process_task_background(
         if final_status in {"failed", "error"}:
             if failure_reason:
                 result["failure_reason"] = failure_reason
+            await manager.flush_progress(task_id)
             await record_event(
                 task_id,
                 "stage_failed",
-                normalize_payload(
-                    {
-                        "stage": failure_context.get("stage") or final_stage,
-                        "reason": failure_reason,
-                        "status": final_status,
-                    }
-                ),
+                {
+                    "stage": failure_context.get("stage") or final_stage,
+                    "reason": failure_reason,
+                    "status": final_status,
+                },
             )
         await apply_task_update(
             {
@@ -4657,39 +5161,38 @@ async def process_task_background(
                 "failure_reason": failure_reason,
             }
         )
-        await record_event(
-            task_id,
-            "TaskCompleted",
-            normalize_payload(
-                {"status": final_status, "progress": final_progress}
+        await gather_side_effects(
+            record_event(
+                task_id,
+                "TaskCompleted",
+                {"status": final_status, "progress": final_progress},
             ),
-        )
-        await record_state(
-            task_id,
-            build_container_state(
-                status=final_status,
-                progress=final_progress,
-                current_stage=final_stage,
-                container=container,
-                active_role=container.metadata.get("active_role") if container else None,
-                current_task=container.current_task if container else None,
+            record_state(
+                task_id,
+                build_container_state(
+                    status=final_status,
+                    progress=final_progress,
+                    current_stage=final_stage,
+                    container=container,
+                    active_role=container.metadata.get("active_role") if container else None,
+                    current_task=container.current_task if container else None,
+                ),
             ),
         )
         logger.info("Task %s completed with status: %s", task_id, final_status)
         
     except Exception as e:
-        logger.error(f"Error processing task {task_id}: {e}")
+        logger.error("Error processing task %s: %s", task_id, e)
         failure_reason = str(e)
+        await manager.flush_progress(task_id)
         await record_event(
             task_id,
             "stage_failed",
-            normalize_payload(
-                {
-                    "stage": failure_context.get("stage") or "processing",
-                    "reason": failure_reason,
-                    "status": "error",
-                }
-            ),
+            {
+                "stage": failure_context.get("stage") or "processing",
+                "reason": failure_reason,
+                "status": "error",
+            },
         )
         await apply_task_update(
             {
@@ -4703,7 +5206,7 @@ async def process_task_background(
         await record_event(
             task_id,
             "TaskFailed",
-            normalize_payload({"error": failure_reason}),
+            {"error": failure_reason},
         )
         await record_state(
             task_id,
@@ -4736,53 +5239,85 @@ def save_container_to_file(task_id: str, container: Container):
             task_id,
         )
         return
+    write_container_file(task_id, container.to_dict())
+
+
+def write_container_file(task_id: str, container_data: Dict[str, Any]) -> None:
+    """Сериализует готовый снимок контейнера и атомарно пишет его; безопасно вызывать из потока"""
+    tmp_path = None
     try:
-        data = container.to_dict()
+        data = orjson.dumps(container_data, default=str, option=_ORJSON_OPTIONS)
         filepath = f"data/tasks/{task_id}.json"
-        
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, default=str)
-        
-        logger.info(f"Container saved to {filepath}")
+        # Уникальный временный файл в той же папке: параллельные сохранения не пишут в один файл,
+        # а os.replace остается атомарным, и читатель не увидит наполовину записанный JSON
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(filepath),
+            prefix=f"{task_id}.",
+            suffix=".tmp",
+        )
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, filepath)
+        tmp_path = None
+
+        logger.info("Container saved to %s", filepath)
     except Exception as e:
-        logger.error(f"Error saving container: {e}")
+        logger.error("Error saving container: %s", e)
+    finally:
+        if tmp_path is not None:
+            with suppress(OSError):
+                os.unlink(tmp_path)
+
+LANGUAGE_BY_EXTENSION = {
+    '.py': 'python',
+    '.js': 'javascript',
+    '.jsx': 'javascript',
+    '.ts': 'typescript',
+    '.tsx': 'typescript',
+    '.html': 'html',
+    '.css': 'css',
+    '.json': 'json',
+    '.yaml': 'yaml',
+    '.yml': 'yaml',
+    '.md': 'markdown',
+    '.txt': 'text',
+    '.sh': 'bash',
+    '.sql': 'sql',
+    '.java': 'java',
+    '.cpp': 'cpp',
+    '.c': 'c',
+    '.go': 'go',
+    '.rs': 'rust',
+    '.rb': 'ruby',
+    '.php': 'php'
+}
+
 
 def get_language_from_extension(filename: str) -> str:
     """Определяет язык программирования по расширению файла"""
-    ext_map = {
-        '.py': 'python',
-        '.js': 'javascript',
-        '.jsx': 'javascript',
-        '.ts': 'typescript',
-        '.tsx': 'typescript',
-        '.html': 'html',
-        '.css': 'css',
-        '.json': 'json',
-        '.yaml': 'yaml',
-        '.yml': 'yaml',
-        '.md': 'markdown',
-        '.txt': 'text',
-        '.sh': 'bash',
-        '.sql': 'sql',
-        '.java': 'java',
-        '.cpp': 'cpp',
-        '.c': 'c',
-        '.go': 'go',
-        '.rs': 'rust',
-        '.rb': 'ruby',
-        '.php': 'php'
-    }
-    
-    for ext, lang in ext_map.items():
-        if filename.endswith(ext):
-            return lang
-    
-    return 'text'
+    return LANGUAGE_BY_EXTENSION.get(os.path.splitext(filename)[1].lower(), 'text')
+
+class FrontendStaticFiles(StaticFiles):
+    """StaticFiles с явным Cache-Control.
+
+    Имена файлов фронтенда без хэшей, поэтому app.js/styles.css/index.html
+    браузер перепроверяет каждый раз (ETag -> 304 без тела), а вендорные
+    библиотеки из lib/ кэшируются на сутки.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if Path(full_path).parent.name == "lib":
+            response.headers["Cache-Control"] = "public, max-age=86400"
+        else:
+            response.headers["Cache-Control"] = "no-cache"
+        return response
+
 
 # Монтируем статические файлы фронтенда
 frontend_path = Path(__file__).parent.parent.parent / "frontend"
 if frontend_path.exists():
-    app.mount("/app", StaticFiles(directory=frontend_path, html=True), name="frontend")
+    app.mount("/app", FrontendStaticFiles(directory=frontend_path, html=True), name="frontend")
     
     @app.get("/app/{full_path:path}")
     async def serve_frontend(full_path: str):
@@ -22,6 +22,16 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def use_uvloop() -> bool:
+    """Use uvloop for asyncio.run() modes too; uvicorn.run() already picks it itself."""
+    try:
+        import uvloop
+    except ImportError:
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
 def get_port() -> int:
     """Return the port the server should bind to."""
     return int(os.getenv("PORT", "8080"))
@@ -34,7 +44,17 @@ def get_workers() -> int:
     except ValueError:
         logger.warning("Invalid WEB_CONCURRENCY value '%s'; defaulting to 1", raw_value)
         workers = 1
-    return max(1, workers)
+    workers = max(1, workers)
+    if workers > 1 and not os.getenv("DATABASE_URL"):
+        # Без Postgres задачи, события и контейнеры живут в памяти процесса,
+        # и воркеры не видели бы состояние друг друга
+        logger.warning(
+            "WEB_CONCURRENCY=%s ignored: in-memory storage requires a single worker; "
+            "set DATABASE_URL to run multiple workers",
+            workers,
+        )
+        workers = 1
+    return workers
 
 
 def log_startup(port: int) -> None:
@@ -153,6 +173,8 @@ def main():
         mode = "prod"
     else:
         mode = sys.argv[1].lower()
+
+    use_uvloop()
     
     try:
         if mode == "dev":
@@ -0,0 +1,43 @@
+import uuid
+
+import pytest
+
+from app import db
+from app.llm import load_llm_settings
+from app.main import hash_api_key, storage
+from app.models import Container
+
+
+@pytest.fixture(autouse=True)
+def _reset_llm_settings_cache():
+    load_llm_settings.cache_clear()
+    yield
+    load_llm_settings.cache_clear()
+
+
+@pytest.fixture
+def seed_task_with_files():
+    """Seed an in-memory task owned by "test-key" with the given container files."""
+    storage.active_tasks.clear()
+    storage.containers.clear()
+
+    def seed(files: dict) -> tuple[str, str]:
+        task_id = str(uuid.uuid4())
+        api_key = "test-key"
+        now = db.now_utc()
+        storage.active_tasks[task_id] = {
+            "id": task_id,
+            "status": "completed",
+            "created_at": now,
+            "updated_at": now,
+            "owner_key_hash": hash_api_key(api_key),
+            "owner_user_id": None,
+        }
+        container = Container(task_id)
+        container.files.update(files)
+        storage.containers[task_id] = container
+        return task_id, api_key
+
+    yield seed
+    storage.active_tasks.clear()
+    storage.containers.clear()
@@ -0,0 +1,28 @@
+from fastapi.testclient import TestClient
+
+import app.main as main_module
+from app.llm import load_llm_settings
+from app.main import app
+
+
+client = TestClient(app)
+
+
+def test_admin_reload_requires_configured_api_key(monkeypatch) -> None:
+    monkeypatch.delenv("AUTH_MODE", raising=False)
+    monkeypatch.setattr(main_module, "APP_API_KEY", None)
+    response = client.post("/admin/reload", headers={"X-API-Key": "anything"})
+    assert response.status_code == 403
+
+
+def test_admin_reload_picks_up_env_changes(monkeypatch) -> None:
+    monkeypatch.delenv("AUTH_MODE", raising=False)
+    monkeypatch.setattr(main_module, "APP_API_KEY", "secret")
+    monkeypatch.setenv("LLM_MAX_CONCURRENCY", "4")
+    assert load_llm_settings().max_concurrency == 4
+
+    monkeypatch.setenv("LLM_MAX_CONCURRENCY", "8")
+    response = client.post("/admin/reload", headers={"X-API-Key": "secret"})
+    assert response.status_code == 200
+    assert "llm" in response.json()["reloaded"]
+    assert load_llm_settings().max_concurrency == 8
@@ -0,0 +1,74 @@
+import pytest
+
+from app import db, main
+from app.main import (
+    load_container_from_file,
+    persist_container_snapshot,
+    save_container_to_file,
+    storage,
+    write_container_file,
+)
+from app.models import Container
+
+
+@pytest.fixture
+def tasks_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, "get_file_persistence_setting", lambda: True)
+    (tmp_path / "data" / "tasks").mkdir(parents=True)
+    storage.containers.clear()
+    yield tmp_path / "data" / "tasks"
+    storage.containers.clear()
+
+
+def test_container_file_round_trip(tasks_dir) -> None:
+    container = Container("task")
+    container.add_file("main.py", "print('hi')\n")
+
+    save_container_to_file("task", container)
+
+    assert [path.name for path in tasks_dir.iterdir()] == ["task.json"]
+    loaded = load_container_from_file("task")
+    assert loaded is not None
+    assert loaded.files == {"main.py": "print('hi')\n"}
+    assert loaded.created_at == container.created_at
+
+
+def test_failed_container_write_leaves_no_temp_file(tasks_dir, monkeypatch) -> None:
+    def failing_replace(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(main.os, "replace", failing_replace)
+
+    write_container_file("task", Container("task").to_dict())
+
+    assert list(tasks_dir.iterdir()) == []
+
+
+def test_missing_container_file_returns_none(tasks_dir) -> None:
+    assert load_container_from_file("absent") is None
+
+
+@pytest.mark.asyncio
+async def test_unchanged_snapshot_is_not_rewritten(monkeypatch) -> None:
+    written = []
+
+    async def fake_upsert(task_id, snapshot):
+        written.append(snapshot)
+
+    monkeypatch.setattr(db, "is_enabled", lambda: True)
+    monkeypatch.setattr(db, "upsert_container_snapshot", fake_upsert)
+    monkeypatch.setattr(main, "_snapshot_digests", main.ContainerCache(maxsize=2))
+    container = Container("task")
+
+    await persist_container_snapshot("task", container)
+    await persist_container_snapshot("task", container)
+    container.add_file("main.py", "print('hi')\n")
+    await persist_container_snapshot("task", container)
+
+    assert len(written) == 2
+    assert [entry["path"] for entry in written[1]["files"]] == ["main.py"]
+
+    await persist_container_snapshot("other", Container("other"))
+    await persist_container_snapshot("third", Container("third"))
+    assert list(main._snapshot_digests) == ["other", "third"]
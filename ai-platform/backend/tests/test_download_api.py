@@ -0,0 +1,84 @@
+import hashlib
+import io
+import json
+import zipfile
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+
+client = TestClient(app)
+
+
+def test_download_zip_streams_files_and_manifest(seed_task_with_files) -> None:
+    files = {"main.py": "print('hi')\n", "docs/README.md": "# Привет\n"}
+    task_id, api_key = seed_task_with_files(files)
+
+    response = client.get(
+        f"/api/tasks/{task_id}/download.zip", headers={"X-API-Key": api_key}
+    )
+
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    root = f"task_{task_id}/"
+    for path, content in files.items():
+        assert archive.read(f"{root}{path}").decode("utf-8") == content
+    manifest = json.loads(archive.read(f"{root}manifest.json"))
+    assert manifest["files_count"] == 2
+    by_path = {entry["path"]: entry for entry in manifest["files"]}
+    expected = files["docs/README.md"].encode("utf-8")
+    assert by_path["docs/README.md"]["sha256"] == hashlib.sha256(expected).hexdigest()
+
+
+def test_download_zip_rejects_unsafe_paths_before_streaming(seed_task_with_files) -> None:
+    task_id, api_key = seed_task_with_files({"../escape.py": "x"})
+
+    response = client.get(
+        f"/api/tasks/{task_id}/download.zip", headers={"X-API-Key": api_key}
+    )
+
+    assert response.status_code == 400
+
+
+def test_download_zip_deflates_text_and_stores_precompressed_files(seed_task_with_files) -> None:
+    task_id, api_key = seed_task_with_files(
+        {"main.py": "print('hi')\n" * 200, "logo.png": b"\x89PNG" + b"\x00" * 64}
+    )
+
+    response = client.get(
+        f"/api/tasks/{task_id}/download.zip", headers={"X-API-Key": api_key}
+    )
+
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    root = f"task_{task_id}/"
+    assert archive.getinfo(f"{root}main.py").compress_type == zipfile.ZIP_DEFLATED
+    assert archive.getinfo(f"{root}logo.png").compress_type == zipfile.ZIP_STORED
+
+
+def test_download_zip_round_trips_files_larger_than_write_chunk(seed_task_with_files) -> None:
+    big = "".join(f"line {index}\n" for index in range(20000))
+    task_id, api_key = seed_task_with_files({"big.txt": big, "empty.txt": ""})
+
+    response = client.get(
+        f"/api/tasks/{task_id}/download.zip", headers={"X-API-Key": api_key}
+    )
+
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    root = f"task_{task_id}/"
+    assert archive.testzip() is None
+    assert archive.read(f"{root}big.txt").decode("utf-8") == big
+    assert archive.read(f"{root}empty.txt") == b""
+
+
+def test_git_export_zip_contains_apply_script(seed_task_with_files) -> None:
+    task_id, api_key = seed_task_with_files({"main.py": "print('hi')\n"})
+
+    response = client.get(
+        f"/api/tasks/{task_id}/git-export.zip", headers={"X-API-Key": api_key}
+    )
+
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert archive.testzip() is None
+    assert f"task_{task_id}/git_export/apply.sh" in archive.namelist()
@@ -0,0 +1,179 @@
+import asyncio
+
+import pytest
+
+from app import db
+from app.main import EventFlusher, gather_side_effects
+
+
+@pytest.mark.asyncio
+async def test_event_flusher_batches_events_in_submission_order(monkeypatch) -> None:
+    batches = []
+
+    async def fake_bulk(events):
+        batches.append(list(events))
+
+    monkeypatch.setattr(db, "append_events_bulk", fake_bulk)
+    flusher = EventFlusher(max_batch=10, interval_seconds=0)
+    for index in range(3):
+        flusher.submit("task", f"Event{index}", {"n": index})
+
+    flusher.start()
+    await flusher.stop()
+
+    assert len(batches) == 1
+    assert [event[1] for event in batches[0]] == ["Event0", "Event1", "Event2"]
+    timestamps = [event[3] for event in batches[0]]
+    assert timestamps == sorted(timestamps)
+
+
+@pytest.mark.asyncio
+async def test_event_flusher_does_not_retry_rows_when_every_row_fails(monkeypatch) -> None:
+    executed = []
+    single_appends = []
+
+    class DownPool:
+        async def copy_records_to_table(self, table, *, columns, records):
+            raise ConnectionError("database is down")
+
+        async def execute(self, query, *args):
+            executed.append(args[2])
+            raise ConnectionError("database is down")
+
+    async def spy_append(*args, **kwargs):
+        single_appends.append(args)
+
+    monkeypatch.setattr(db, "_pool", DownPool())
+    monkeypatch.setattr(db, "append_event", spy_append)
+    task_id = "00000000-0000-0000-0000-000000000001"
+    flusher = EventFlusher(max_batch=10, interval_seconds=0)
+    for event_type in ["First", "Second", "Third"]:
+        flusher.submit(task_id, event_type, {})
+    flusher.start()
+    await flusher.stop()
+
+    assert executed == ["First", "Second", "Third"]
+    assert single_appends == []
+
+
+@pytest.mark.asyncio
+async def test_event_flusher_flush_ignores_later_events(monkeypatch) -> None:
+    release = {"Early": asyncio.Event(), "Late": asyncio.Event()}
+    batches = []
+
+    async def slow_bulk(events):
+        batches.append([event[1] for event in events])
+        await release[events[0][1]].wait()
+
+    monkeypatch.setattr(db, "append_events_bulk", slow_bulk)
+    flusher = EventFlusher(max_batch=1, interval_seconds=0)
+    flusher.start()
+    flusher.submit("task", "Early", {})
+    early_flush = asyncio.create_task(flusher.flush())
+    await asyncio.sleep(0)
+    flusher.submit("other", "Late", {})
+    release["Early"].set()
+
+    await asyncio.wait_for(early_flush, timeout=1)
+    assert batches[0] == ["Early"]
+
+    release["Late"].set()
+    await flusher.stop()
+    assert batches == [["Early"], ["Late"]]
+
+
+@pytest.mark.asyncio
+async def test_event_flusher_flush_returns_when_worker_died(monkeypatch) -> None:
+    flusher = EventFlusher(max_batch=1, interval_seconds=0)
+    flusher.start()
+    flusher._worker_task.cancel()
+    flusher.submit("task", "Orphan", {})
+
+    await asyncio.wait_for(flusher.flush(), timeout=1)
+    await flusher.stop()
+
+
+@pytest.mark.asyncio
+async def test_gather_side_effects_finishes_all_before_raising() -> None:
+    finished = []
+
+    async def ok(name):
+        finished.append(name)
+
+    async def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError, match="boom"):
+        await gather_side_effects(ok("a"), fail(), ok("b"))
+
+    assert finished == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_append_events_bulk_uses_copy(monkeypatch) -> None:
+    copies = []
+
+    class FakePool:
+        async def copy_records_to_table(self, table, *, columns, records):
+            copies.append((table, columns, list(records)))
+
+    monkeypatch.setattr(db, "_pool", FakePool())
+    task_id = "00000000-0000-0000-0000-000000000001"
+    created_at = db.now_utc()
+
+    await db.append_events_bulk([(task_id, "Started", {"n": 1}, created_at)])
+
+    table, columns, records = copies[0]
+    assert table == "task_events"
+    assert columns == ["id", "task_id", "type", "payload_json", "created_at"]
+    assert [(str(r[1]), r[2], r[3], r[4]) for r in records] == [
+        (task_id, "Started", '{"n": 1}', created_at)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_append_events_bulk_falls_back_to_rows_when_copy_fails(monkeypatch) -> None:
+    inserted = []
+
+    class FakePool:
+        async def copy_records_to_table(self, table, *, columns, records):
+            raise ValueError("bad row in COPY stream")
+
+        async def execute(self, query, event_id, task_id, event_type, payload_json, created_at):
+            if event_type == "Broken":
+                raise ValueError("bad row")
+            inserted.append((str(task_id), event_type, payload_json))
+
+    monkeypatch.setattr(db, "_pool", FakePool())
+    task_id = "00000000-0000-0000-0000-000000000001"
+    created_at = db.now_utc()
+
+    await db.append_events_bulk(
+        [
+            (task_id, "Started", {"n": 1}, created_at),
+            (task_id, "Broken", {"n": 2}, created_at),
+            ("not-a-uuid", "Orphan", {"n": 3}, created_at),
+            (task_id, "Finished", {"n": 4}, created_at),
+        ]
+    )
+
+    assert inserted == [
+        (task_id, "Started", '{"n": 1}'),
+        (task_id, "Finished", '{"n": 4}'),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_event_flusher_flush_gives_up_on_stalled_write(monkeypatch) -> None:
+    async def stalled_bulk(events):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(db, "append_events_bulk", stalled_bulk)
+    flusher = EventFlusher(max_batch=1, interval_seconds=0, flush_timeout_seconds=0.05)
+    flusher.start()
+    flusher.submit("task", "Stuck", {})
+
+    await asyncio.wait_for(flusher.flush(), timeout=1)
+    await asyncio.wait_for(flusher.stop(), timeout=1)
+
+    assert not flusher.is_running
@@ -0,0 +1,73 @@
+from fastapi.testclient import TestClient
+
+from app.main import app, get_language_from_extension
+
+
+client = TestClient(app)
+
+
+def test_task_files_grouped_by_type(seed_task_with_files) -> None:
+    task_id, api_key = seed_task_with_files(
+        {
+            "app/main.py": "",
+            "tests/test_main.py": "",
+            "config.yml": "",
+            "README.md": "",
+            "Dockerfile": "",
+        }
+    )
+
+    response = client.get(f"/api/tasks/{task_id}/files", headers={"X-API-Key": api_key})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    body = response.json()
+    assert body["total"] == 5
+    assert body["by_type"] == {
+        "code": ["app/main.py", "tests/test_main.py"],
+        "config": ["config.yml"],
+        "docs": ["README.md"],
+        "tests": ["tests/test_main.py"],
+        "other": ["config.yml", "Dockerfile"],
+    }
+
+
+def test_language_from_extension() -> None:
+    assert get_language_from_extension("src/App.TSX") == "typescript"
+    assert get_language_from_extension("main.c") == "c"
+    assert get_language_from_extension("Dockerfile") == "text"
+
+
+def test_file_content_prefers_exact_path(seed_task_with_files) -> None:
+    task_id, api_key = seed_task_with_files(
+        {"app/main.py": "nested", "main.py": "root"}
+    )
+    headers = {"X-API-Key": api_key}
+
+    exact = client.get(f"/api/tasks/{task_id}/files/main.py", headers=headers)
+    partial = client.get(f"/api/tasks/{task_id}/files/app/main", headers=headers)
+    missing = client.get(f"/api/tasks/{task_id}/files/absent.py", headers=headers)
+
+    assert exact.json()["content"] == "root"
+    assert partial.json()["path"] == "app/main.py"
+    assert missing.status_code == 404
+
+
+def test_frontend_assets_send_cache_headers() -> None:
+    app_js = client.get("/app/app.js")
+    vendored = client.get("/app/lib/jszip.min.js")
+
+    assert app_js.headers["cache-control"] == "no-cache"
+    assert vendored.headers["cache-control"] == "public, max-age=86400"
+    revalidated = client.get("/app/app.js", headers={"If-None-Match": app_js.headers["etag"]})
+    assert revalidated.status_code == 304
+
+
+def test_large_binary_file_content_is_decoded(seed_task_with_files) -> None:
+    payload = "данные\n".encode("utf-8") * 20_000
+    task_id, api_key = seed_task_with_files({"big.log": payload + b"\xff"})
+
+    response = client.get(f"/api/tasks/{task_id}/files/big.log", headers={"X-API-Key": api_key})
+
+    assert response.status_code == 200
+    assert response.json()["content"] == payload.decode("utf-8") + "�"
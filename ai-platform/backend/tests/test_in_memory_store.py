@@ -0,0 +1,153 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from app.main import (
+    PROGRESS_DEBOUNCE_MS,
+    PROGRESS_FANOUT_CHUNK,
+    ContainerCache,
+    get_in_memory_artifacts,
+    get_in_memory_events,
+    manager,
+    storage,
+    store_in_memory_artifact,
+    store_in_memory_event,
+)
+
+
+class FakeWebSocket:
+    def __init__(self, broken: bool = False) -> None:
+        self.broken = broken
+        self.sent = []
+
+    async def send_text(self, text: str) -> None:
+        if self.broken:
+            raise RuntimeError("closed")
+        self.sent.append(text)
+
+
+@pytest.fixture(autouse=True)
+def reset_storage() -> None:
+    storage.events.clear()
+    storage.artifacts.clear()
+    storage.artifacts_by_type.clear()
+
+
+def test_events_are_returned_in_insertion_order() -> None:
+    for index in range(5):
+        store_in_memory_event("task", f"Event{index}")
+
+    desc = get_in_memory_events("task", limit=2, order="desc")
+    asc = get_in_memory_events("task", limit=2, order="asc")
+
+    assert [event["type"] for event in desc] == ["Event4", "Event3"]
+    assert [event["type"] for event in asc] == ["Event0", "Event1"]
+    assert get_in_memory_events("task", limit=0, order="desc") == []
+
+
+def test_artifacts_filter_by_type_before_limit() -> None:
+    store_in_memory_artifact("task", "code", {"n": 1})
+    store_in_memory_artifact("task", "tests", {"n": 2})
+    store_in_memory_artifact("task", "code", {"n": 3})
+
+    latest = get_in_memory_artifacts("task", "code", limit=1, order="desc")
+
+    assert [artifact["payload"]["n"] for artifact in latest] == [3]
+
+
+def test_container_cache_evicts_least_recently_used() -> None:
+    cache = ContainerCache(maxsize=2)
+    cache["a"] = "A"
+    cache["b"] = "B"
+    assert cache.get("a") == "A"
+
+    cache["c"] = "C"
+
+    assert list(cache) == ["a", "c"]
+    assert cache.get("b") is None
+
+
+@pytest.mark.asyncio
+async def test_send_progress_sends_json_text_frames() -> None:
+    websocket = FakeWebSocket()
+    manager.active_connections["task"] = {websocket}
+    try:
+        delivered = await manager.send_progress(
+            "task", {"progress": 0.5, "at": datetime(2024, 1, 1, tzinfo=timezone.utc)}
+        )
+    finally:
+        manager.active_connections.pop("task", None)
+
+    assert delivered is True
+    assert json.loads(websocket.sent[0]) == {"progress": 0.5, "at": "2024-01-01T00:00:00+00:00"}
+
+
+@pytest.mark.asyncio
+async def test_schedule_progress_coalesces_updates() -> None:
+    built = []
+
+    def build(progress: float):
+        def payload():
+            built.append(progress)
+            return {"progress": progress}
+
+        return payload
+
+    websocket = FakeWebSocket()
+    manager.active_connections["task"] = {websocket}
+    try:
+        manager.schedule_progress("task", build(0.1))
+        manager.schedule_progress("task", build(0.2))
+        await asyncio.sleep(PROGRESS_DEBOUNCE_MS / 1000 + 0.05)
+    finally:
+        manager.active_connections.pop("task", None)
+
+    assert built == [0.2]
+    assert [json.loads(text) for text in websocket.sent] == [{"progress": 0.2}]
+
+
+@pytest.mark.asyncio
+async def test_send_progress_fans_out_and_drops_broken_sockets() -> None:
+    first, second, broken = FakeWebSocket(), FakeWebSocket(), FakeWebSocket(broken=True)
+    manager.active_connections["task"] = {first, second, broken}
+    try:
+        delivered = await manager.send_progress("task", {"progress": 1.0})
+        remaining = set(manager.active_connections["task"])
+    finally:
+        manager.active_connections.pop("task", None)
+
+    assert delivered is True
+    assert len(first.sent) == len(second.sent) == 1
+    assert remaining == {first, second}
+
+
+@pytest.mark.asyncio
+async def test_flush_progress_sends_pending_update_immediately() -> None:
+    websocket = FakeWebSocket()
+    manager.active_connections["task"] = {websocket}
+    try:
+        manager.schedule_progress("task", lambda: {"progress": 1.0})
+        await manager.flush_progress("task")
+        sent_before_window = list(websocket.sent)
+        await asyncio.sleep(PROGRESS_DEBOUNCE_MS / 1000 + 0.05)
+    finally:
+        manager.active_connections.pop("task", None)
+
+    assert [json.loads(text) for text in sent_before_window] == [{"progress": 1.0}]
+    assert websocket.sent == sent_before_window
+    assert [event["type"] for event in get_in_memory_events("task", limit=10, order="asc")] == ["ProgressUpdate"]
+
+
+@pytest.mark.asyncio
+async def test_send_progress_reaches_every_socket_across_chunks() -> None:
+    sockets = [FakeWebSocket() for _ in range(PROGRESS_FANOUT_CHUNK * 2 + 1)]
+    manager.active_connections["task"] = set(sockets)
+    try:
+        delivered = await manager.send_progress("task", {"progress": 0.3})
+    finally:
+        manager.active_connections.pop("task", None)
+
+    assert delivered is True
+    assert all(len(websocket.sent) == 1 for websocket in sockets)
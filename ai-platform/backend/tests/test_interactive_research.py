@@ -15,6 +15,7 @@ def reset_storage() -> None:
     storage.events.clear()
     storage.state.clear()
     storage.artifacts.clear()
+    storage.artifacts_by_type.clear()
     storage.containers.clear()
 
 
@@ -1,13 +1,30 @@
+import asyncio
 import json
 
 import pytest
 
 from app.llm import (
+    BinnedDispatcher,
+    ConcurrencyLimiter,
     LLMOutputTruncatedError,
+    LLMProviderError,
     LLMSettings,
+    MockProvider,
     OpenAIProvider,
+    ResultCache,
+    TokenBucket,
+    generate_batch,
+    generate_many,
     generate_text_chunks_json,
     generate_with_retry,
+    load_llm_settings,
+)
+from app.llm import (
+    _BACKOFF_MAX_SECONDS,
+    _backoff_delay,
+    _get_request_limits,
+    _inject_json_system_instruction,
+    _parse_chunk_payload,
 )
 
 
@@ -26,7 +43,13 @@ class FakeProvider:
         max_tokens,
         response_format=None,
     ):
-        self.calls.append({"max_tokens": max_tokens, "response_format": response_format})
+        self.calls.append(
+            {
+                "messages": messages,
+                "max_tokens": max_tokens,
+                "response_format": response_format,
+            }
+        )
         if not self.responses:
             raise AssertionError("No more responses configured.")
         return self.responses.pop(0)
@@ -140,6 +163,51 @@ async def test_generate_with_retry_continues_on_truncation():
     assert response["text"] == "hello world"
 
 
+@pytest.mark.asyncio
+async def test_generate_with_retry_continuation_sends_only_output_tail():
+    provider = FakeProvider(
+        [
+            {
+                "text": "ignored",
+                "usage": {"input_tokens": 1, "output_tokens": 1, "total_tokens": 2},
+                "finish_reason": "length",
+            },
+            {
+                "text": "abcdefgh",
+                "usage": {"input_tokens": 1, "output_tokens": 1, "total_tokens": 2},
+                "finish_reason": "length",
+            },
+            {
+                "text": "ij",
+                "usage": {"input_tokens": 1, "output_tokens": 1, "total_tokens": 2},
+                "finish_reason": "stop",
+            },
+        ]
+    )
+    settings = LLMSettings(
+        provider="openai",
+        model="gpt-4o-mini",
+        api_key="test",
+        max_tokens=50,
+        max_tokens_coder=50,
+        timeout_seconds=10,
+        temperature=0.2,
+        response_format="json_object",
+        chunking_enabled=True,
+        max_chunks=8,
+        max_file_chars=12000,
+        continuation_tail_chars=3,
+    )
+    messages = [{"role": "user", "content": "write"}]
+
+    response = await generate_with_retry(provider, messages, settings)
+
+    assert response["text"] == "abcdefghij"
+    continuation = provider.calls[2]["messages"]
+    assert continuation[:-2] == messages
+    assert continuation[-2] == {"role": "assistant", "content": "fgh"}
+
+
 @pytest.mark.asyncio
 async def test_generate_with_retry_truncation_raises_after_continuations():
     provider = FakeProvider(
@@ -191,19 +259,272 @@ async def test_generate_with_retry_truncation_raises_after_continuations():
     assert excinfo.value.usage["total_tokens"] == 30
 
 
+@pytest.mark.asyncio
+async def test_generate_with_retry_serves_identical_json_requests_from_cache():
+    provider = FakeProvider(
+        [
+            {
+                "text": "{\"cached\":true}",
+                "usage": {"input_tokens": 2, "output_tokens": 2, "total_tokens": 4},
+                "finish_reason": "stop",
+            }
+        ]
+    )
+    settings = LLMSettings(
+        provider="openai",
+        model="gpt-4o-mini-cache-test",
+        api_key="test",
+        max_tokens=100,
+        max_tokens_coder=100,
+        timeout_seconds=10,
+        temperature=0.2,
+        response_format="json_object",
+        chunking_enabled=True,
+        max_chunks=8,
+        max_file_chars=12000,
+        cache_max_mb=1,
+        cache_ttl_seconds=60,
+    )
+    messages = [{"role": "user", "content": "ping"}]
+
+    first = await generate_with_retry(provider, messages, settings, require_json=True)
+    second = await generate_with_retry(provider, messages, settings, require_json=True)
+
+    assert len(provider.calls) == 1
+    assert first["usage"]["total_tokens"] == 4
+    assert second["text"] == first["text"]
+    assert second["usage"]["total_tokens"] == 0
+    assert second["cache_hit"] is True
+
+
+def test_result_cache_evicts_least_recently_used_entries():
+    cache = ResultCache(max_size_mb=0.0006, ttl_seconds=60)
+    value = {"text": "x" * 200, "usage": {}, "finish_reason": "stop"}
+
+    cache.set("a", value)
+    cache.set("b", value)
+    assert cache.get("a") is not None
+    cache.set("c", value)
+
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+
+
+@pytest.mark.asyncio
+async def test_generate_with_retry_serves_paraphrased_prompts_from_semantic_cache():
+    class EmbeddingProvider(FakeProvider):
+        async def embed_text(self, text, model):
+            return [1.0, 0.0] if "summary" in text else [0.0, 1.0]
+
+    provider = EmbeddingProvider(
+        [
+            {
+                "text": "summary text",
+                "usage": {"input_tokens": 2, "output_tokens": 2, "total_tokens": 4},
+                "finish_reason": "stop",
+            },
+            {
+                "text": "other text",
+                "usage": {"input_tokens": 2, "output_tokens": 2, "total_tokens": 4},
+                "finish_reason": "stop",
+            },
+        ]
+    )
+    settings = LLMSettings(
+        provider="openai",
+        model="gpt-4o-mini-semantic-test",
+        api_key="test",
+        max_tokens=100,
+        max_tokens_coder=100,
+        timeout_seconds=10,
+        temperature=0.0,
+        response_format="json_object",
+        chunking_enabled=True,
+        max_chunks=8,
+        max_file_chars=12000,
+        semantic_cache_threshold=0.92,
+    )
+    system = {"role": "system", "content": "be brief"}
+
+    first = await generate_with_retry(
+        provider, [system, {"role": "user", "content": "Give me a summary of X"}], settings
+    )
+    second = await generate_with_retry(
+        provider, [system, {"role": "user", "content": "Write a summary of X"}], settings
+    )
+    third = await generate_with_retry(
+        provider, [system, {"role": "user", "content": "Translate X"}], settings
+    )
+
+    assert first["text"] == "summary text"
+    assert second["text"] == "summary text"
+    assert second["cache_hit"] is True
+    assert third["text"] == "other text"
+    assert len(provider.calls) == 2
+
+
+def test_result_cache_caps_entry_count():
+    cache = ResultCache(max_size_mb=1, ttl_seconds=60, max_entries=2)
+    value = {"text": "x", "usage": {}, "finish_reason": "stop"}
+
+    for key in ("a", "b", "c"):
+        cache.set(key, value)
+
+    assert len(cache) == 2
+    assert cache.get("a") is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("retry_after", "expected_sleep"),
+    [(0.25, 0.25), (86400.0, _BACKOFF_MAX_SECONDS)],
+)
+async def test_generate_with_retry_sleeps_for_capped_retry_after(
+    monkeypatch, retry_after, expected_sleep
+):
+    class RateLimitedProvider(FakeProvider):
+        async def generate_text(self, *args, **kwargs):
+            if not self.calls:
+                self.calls.append(kwargs)
+                raise LLMProviderError("rate limited", retryable=True, retry_after=retry_after)
+            return await super().generate_text(*args, **kwargs)
+
+    sleeps = []
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr("app.llm.asyncio.sleep", fake_sleep)
+    provider = RateLimitedProvider(
+        [
+            {
+                "text": "ok",
+                "usage": {"input_tokens": 1, "output_tokens": 1, "total_tokens": 2},
+                "finish_reason": "stop",
+            }
+        ]
+    )
+    settings = LLMSettings(
+        provider="openai",
+        model="gpt-4o-mini",
+        api_key="test",
+        max_tokens=50,
+        max_tokens_coder=50,
+        timeout_seconds=10,
+        temperature=0.2,
+        response_format="json_object",
+        chunking_enabled=True,
+        max_chunks=8,
+        max_file_chars=12000,
+    )
+
+    response = await generate_with_retry(provider, [], settings)
+
+    assert response["text"] == "ok"
+    assert sleeps == [expected_sleep]
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_spends_burst_capacity_then_waits_for_refill(monkeypatch):
+    sleeps = []
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+        bucket._tokens += seconds * bucket.refill_per_second
+
+    monkeypatch.setattr("app.llm.asyncio.sleep", fake_sleep)
+    bucket = TokenBucket(2)
+
+    await bucket.acquire()
+    await bucket.acquire()
+    assert sleeps == []
+
+    await bucket.acquire()
+    assert len(sleeps) == 1
+    assert sleeps[0] > 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("requests_per_minute", [60, 0])
+async def test_token_bucket_pause_holds_back_requests_until_cooldown(
+    monkeypatch, requests_per_minute
+):
+    sleeps = []
+    clock = {"now": 100.0}
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+        clock["now"] += seconds
+
+    monkeypatch.setattr("app.llm.time.monotonic", lambda: clock["now"])
+    monkeypatch.setattr("app.llm.asyncio.sleep", fake_sleep)
+    bucket = TokenBucket(requests_per_minute)
+
+    bucket.pause(5)
+    await bucket.acquire()
+
+    assert sleeps == [5]
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limiter_resize_applies_to_requests_in_flight():
+    limiter = ConcurrencyLimiter(2)
+    entered = []
+    release = asyncio.Event()
+
+    async def call(name):
+        async with limiter:
+            entered.append(name)
+            await release.wait()
+
+    first = [asyncio.create_task(call(name)) for name in ("a", "b")]
+    await asyncio.sleep(0)
+    limiter.resize(1)
+    late = asyncio.create_task(call("c"))
+    await asyncio.sleep(0)
+    assert entered == ["a", "b"]
+
+    limiter.resize(3)
+    await asyncio.sleep(0)
+    assert entered == ["a", "b", "c"]
+
+    release.set()
+    await asyncio.gather(*first, late)
+
+
+def test_request_limits_are_resized_instead_of_replaced(monkeypatch):
+    monkeypatch.setattr("app.llm._request_limits", None)
+
+    semaphore, bucket = _get_request_limits(4, 60)
+    resized = _get_request_limits(8, 0)
+
+    assert resized == (semaphore, bucket)
+    assert semaphore.limit == 8
+    assert bucket.capacity == 0
+
+
 @pytest.mark.asyncio
 async def test_openai_provider_captures_finish_reason(monkeypatch):
     class DummyResponse:
-        def __init__(self, data):
-            self._data = data
+        is_error = False
+
+        def __init__(self, events):
+            self._lines = [f"data: {json.dumps(event)}" for event in events] + ["data: [DONE]"]
             self.status_code = 200
-            self.text = json.dumps(data)
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, exc_type, exc, tb):
+            return False
 
         def raise_for_status(self):
             return None
 
-        def json(self):
-            return self._data
+        async def aiter_lines(self):
+            for line in self._lines:
+                yield line
 
     class DummyClient:
         def __init__(self, *args, **kwargs):
@@ -215,17 +536,26 @@ async def test_openai_provider_captures_finish_reason(monkeypatch):
         async def __aexit__(self, exc_type, exc, tb):
             return False
 
-        async def post(self, url, headers=None, json=None):
+        @property
+        def is_closed(self):
+            return False
+
+        def stream(self, method, url, headers=None, content=None, timeout=None):
+            assert headers["Content-Type"] == "application/json"
+            assert json.loads(content)["stream"] is True
             return DummyResponse(
-                {
-                    "choices": [
-                        {"message": {"content": "{}"}, "finish_reason": "length"}
-                    ],
-                    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
-                }
+                [
+                    {"choices": [{"delta": {"content": "{"}, "finish_reason": None}]},
+                    {"choices": [{"delta": {"content": "}"}, "finish_reason": "length"}]},
+                    {
+                        "choices": [],
+                        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+                    },
+                ]
             )
 
     monkeypatch.setattr("app.llm.httpx.AsyncClient", DummyClient)
+    monkeypatch.setattr("app.llm._http_clients", {})
 
     provider = OpenAIProvider("test-key", 10)
     response = await provider.generate_text(
@@ -237,6 +567,9 @@ async def test_openai_provider_captures_finish_reason(monkeypatch):
     )
 
     assert response["finish_reason"] == "length"
+    assert response["text"] == "{}"
+    assert response["usage"]["total_tokens"] == 2
+    assert response["first_token_ms"] >= 0
 
 
 @pytest.mark.asyncio
@@ -397,3 +730,254 @@ async def test_generate_text_chunks_retries_invalid_json():
 
     assert response["text"] == "ok"
     assert len(provider.calls) == 2
+
+
+def test_parse_chunk_payload_validates_schema():
+    payload = _parse_chunk_payload(
+        '{"status":"partial","chunk_index":2,"content_chunk":42,"notes":"n"}',
+        expected_index=2,
+    )
+
+    assert payload == {"status": "partial", "content_chunk": "42"}
+    with pytest.raises(ValueError):
+        _parse_chunk_payload('{"status":"done","chunk_index":1,"content_chunk":""}')
+    with pytest.raises(ValueError):
+        _parse_chunk_payload('{"status":"partial","chunk_index":1}')
+    with pytest.raises(ValueError):
+        _parse_chunk_payload(
+            '{"status":"partial","chunk_index":1,"content_chunk":""}',
+            expected_index=2,
+        )
+
+def test_parse_chunk_payload_keeps_lax_baseline_coercions():
+    assert _parse_chunk_payload(
+        '{"status":"complete","chunk_index":1.0,"content_chunk":true}',
+        expected_index=1,
+    ) == {"status": "complete", "content_chunk": "True"}
+    assert _parse_chunk_payload(
+        '{"status":"partial","chunk_index":"first","content_chunk":[1, 2]}'
+    ) == {"status": "partial", "content_chunk": "[1, 2]"}
+    with pytest.raises(ValueError):
+        _parse_chunk_payload('{"status":"partial","chunk_index":1,"content_chunk":null}')
+
+
+
+@pytest.mark.asyncio
+async def test_generate_text_chunks_stops_when_partial_chunks_fill_char_budget():
+    provider = FakeProvider(
+        [
+            {
+                "text": json.dumps(
+                    {
+                        "status": "partial",
+                        "chunk_index": 1,
+                        "content_chunk": "abcd",
+                    }
+                ),
+                "usage": {"input_tokens": 1, "output_tokens": 2, "total_tokens": 3},
+                "finish_reason": "stop",
+            }
+        ]
+    )
+    settings = LLMSettings(
+        provider="openai",
+        model="gpt-4o-mini",
+        api_key="test",
+        max_tokens=50,
+        max_tokens_coder=50,
+        timeout_seconds=10,
+        temperature=0.2,
+        response_format="json_object",
+        chunking_enabled=True,
+        max_chunks=5,
+        max_file_chars=4,
+    )
+
+    with pytest.raises(LLMOutputTruncatedError) as excinfo:
+        await generate_text_chunks_json(
+            provider,
+            settings,
+            base_messages=[{"role": "system", "content": "test"}],
+            max_tokens=20,
+            max_chunks=5,
+            max_file_chars=4,
+        )
+
+    assert excinfo.value.finish_reason == "max_file_chars"
+    assert len(provider.calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_generate_batch_returns_results_in_request_order():
+    class EchoProvider:
+        name = "mock"
+
+        async def generate_text(self, messages, model, temperature, max_tokens, response_format=None):
+            return {
+                "text": messages[-1]["content"],
+                "usage": {"input_tokens": 1, "output_tokens": 1, "total_tokens": 2},
+                "finish_reason": "stop",
+            }
+
+    settings = LLMSettings(
+        provider="mock",
+        model="gpt-4o-mini",
+        api_key=None,
+        max_tokens=50,
+        max_tokens_coder=50,
+        timeout_seconds=10,
+        temperature=0.2,
+        response_format="json_object",
+        chunking_enabled=True,
+        max_chunks=8,
+        max_file_chars=12000,
+    )
+    requests = [
+        {"messages": [{"role": "user", "content": f"request-{index}"}]} for index in range(5)
+    ]
+
+    results = await generate_batch(EchoProvider(), requests, settings, concurrency=2)
+
+    assert [result["text"] for result in results] == [f"request-{index}" for index in range(5)]
+
+
+def test_inject_json_instruction_prepends_static_prefix_without_touching_system_prompt():
+    provider = FakeProvider([])
+    system = {"role": "system", "content": "You are a coder."}
+    messages = [system, {"role": "user", "content": "hi"}]
+
+    prepared = _inject_json_system_instruction(messages, provider, True)
+
+    assert prepared[0]["role"] == "system"
+    assert "OUTPUT JSON ONLY" in prepared[0]["content"]
+    assert prepared[1:] == messages
+    assert system["content"] == "You are a coder."
+    assert _inject_json_system_instruction(prepared, provider, True) is prepared
+
+
+def test_backoff_delay_grows_with_jitter_and_is_capped():
+    for attempt in range(10):
+        ceiling = min(60.0, 2.0**attempt)
+        delay = _backoff_delay(attempt)
+        assert ceiling / 2 <= delay <= ceiling
+
+
+@pytest.mark.asyncio
+async def test_generate_many_returns_failures_in_place():
+    class FlakyProvider:
+        name = "mock"
+
+        async def generate_text(self, messages, model, temperature, max_tokens, response_format=None):
+            content = messages[-1]["content"]
+            if content == "fail":
+                raise LLMProviderError("boom", retryable=False)
+            return {
+                "text": content,
+                "usage": {"input_tokens": 1, "output_tokens": 1, "total_tokens": 2},
+                "finish_reason": "stop",
+            }
+
+    settings = LLMSettings(
+        provider="mock",
+        model="gpt-4o-mini",
+        api_key=None,
+        max_tokens=50,
+        max_tokens_coder=50,
+        timeout_seconds=10,
+        temperature=0.2,
+        response_format="json_object",
+        chunking_enabled=True,
+        max_chunks=8,
+        max_file_chars=12000,
+    )
+    batch = [[{"role": "user", "content": content}] for content in ("a", "fail", "b")]
+
+    results = await generate_many(FlakyProvider(), batch, settings, concurrency=2)
+
+    assert results[0]["text"] == "a"
+    assert isinstance(results[1], LLMProviderError)
+    assert results[2]["text"] == "b"
+
+
+@pytest.mark.asyncio
+async def test_binned_dispatcher_groups_requests_by_output_budget():
+    class RecordingProvider:
+        name = "mock"
+
+        def __init__(self):
+            self.max_tokens = []
+
+        async def generate_text(self, messages, model, temperature, max_tokens, response_format=None):
+            self.max_tokens.append(max_tokens)
+            return {
+                "text": messages[-1]["content"],
+                "usage": {"input_tokens": 1, "output_tokens": 1, "total_tokens": 2},
+                "finish_reason": "stop",
+            }
+
+    settings = LLMSettings(
+        provider="mock",
+        model="gpt-4o-mini",
+        api_key=None,
+        max_tokens=50,
+        max_tokens_coder=50,
+        timeout_seconds=10,
+        temperature=0.2,
+        response_format="json_object",
+        chunking_enabled=True,
+        max_chunks=8,
+        max_file_chars=12000,
+    )
+    provider = RecordingProvider()
+    dispatcher = BinnedDispatcher(provider, settings, batch_size=2, max_wait_ms=1)
+
+    results = await asyncio.gather(
+        dispatcher.submit([{"role": "user", "content": "long"}], max_tokens=4000),
+        dispatcher.submit([{"role": "user", "content": "short-1"}], max_tokens=100),
+        dispatcher.submit([{"role": "user", "content": "short-2"}], max_tokens=120),
+    )
+
+    assert [result["text"] for result in results] == ["long", "short-1", "short-2"]
+    assert provider.max_tokens == [100, 120, 4000]
+
+
+def test_is_retryable_covers_transient_statuses() -> None:
+    from app.llm import _is_retryable
+
+    assert _is_retryable(408)
+    assert _is_retryable(425)
+    assert _is_retryable(429)
+    assert _is_retryable(503)
+    assert _is_retryable(599)
+    assert not _is_retryable(None)
+    assert not _is_retryable(400)
+    assert not _is_retryable(404)
+
+
+def test_load_llm_settings_names_malformed_env_var(monkeypatch):
+    monkeypatch.setenv("LLM_MAX_TOKENS", "lots")
+
+    with pytest.raises(ValueError, match="LLM_MAX_TOKENS"):
+        load_llm_settings()
+
+
+@pytest.mark.asyncio
+async def test_mock_provider_reads_target_from_json_and_text_prompts():
+    provider = MockProvider()
+
+    json_prompt = json.dumps({"Target file": "app.py", "Task": "Do it"})
+    response = await provider.generate_text(
+        [{"role": "user", "content": json_prompt}], "mock", 0.0, 100
+    )
+    assert json.loads(response["text"])["files"][0]["path"] == "app.py"
+
+    text_prompt = "Target file: util.py\nTask: Do it\n"
+    response = await provider.generate_text(
+        [{"role": "user", "content": text_prompt}], "mock", 0.0, 100
+    )
+    assert json.loads(response["text"])["files"][0]["path"] == "util.py"
+
+    response = await provider.generate_text(
+        [{"role": "user", "content": "{not json\nTarget file: x.py\n"}], "mock", 0.0, 100
+    )
+    assert json.loads(response["text"])["files"][0]["path"] == "x.py"
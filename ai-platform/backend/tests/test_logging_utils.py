@@ -0,0 +1,39 @@
+import json
+import logging
+
+from app.logging_utils import JSONFormatter, configure_logging, reset_request_id, set_request_id
+
+
+def test_records_carry_correlation_ids_from_context() -> None:
+    configure_logging()
+    token = set_request_id("req-1")
+    try:
+        record = logging.getLogger("test").makeRecord(
+            "test", logging.INFO, __file__, 1, "hello", None, None
+        )
+    finally:
+        reset_request_id(token)
+
+    assert record.request_id == "req-1"
+    assert record.task_id == "-"
+
+
+def test_configure_logging_installs_record_factory_once() -> None:
+    configure_logging()
+    factory = logging.getLogRecordFactory()
+    configure_logging()
+    assert logging.getLogRecordFactory() is factory
+
+
+def test_json_formatter_emits_correlation_fields() -> None:
+    formatter = JSONFormatter()
+    record = logging.LogRecord("app", logging.WARNING, __file__, 1, "hi %s", ("there",), None)
+    record.request_id = "req-2"
+    record.task_id = "task-9"
+
+    payload = json.loads(formatter.format(record))
+
+    assert payload["level"] == "WARNING"
+    assert payload["msg"] == "hi there"
+    assert payload["request_id"] == "req-2"
+    assert payload["task_id"] == "task-9"
@@ -61,7 +61,7 @@ def test_manual_next_step_continues_task() -> None:
     assert data["status"] == "queued"
     assert storage.active_tasks[task_id]["awaiting_manual_step"] is False
     events = storage.events.get(task_id, [])
-    event_types = [event["type"] for event in events]
+    event_types = [event.type for event in events]
     assert "manual_step_received" in event_types
     assert "manual_step_applied" in event_types
 
@@ -1,6 +1,17 @@
 """Tests for payload parsing helpers."""
 
-from app.main import coerce_mapping_payload, normalize_artifact_item
+import uuid
+from datetime import datetime, timezone
+
+from pydantic import BaseModel
+
+from app.main import (
+    aggregate_llm_usage,
+    coerce_mapping_payload,
+    normalize_artifact_item,
+    normalize_payload,
+    parse_datetime,
+)
 
 
 def test_coerce_mapping_payload_json_string():
@@ -25,3 +36,62 @@ def test_normalize_artifact_item_parses_payload_string():
     }
     normalized = normalize_artifact_item(artifact)
     assert normalized.payload["passed"] is True
+
+
+def test_normalize_payload_matches_json_encoding_rules():
+    """normalize_payload produces plain JSON types for models, sets, bytes and datetimes."""
+
+    class Item(BaseModel):
+        name: str
+
+    created = datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    task_id = uuid.UUID(int=7)
+    payload = normalize_payload(
+        {"item": Item(name="x"), "tags": {"a"}, "raw": b"hi", "at": created, "id": task_id}
+    )
+    assert payload == {
+        "item": {"name": "x"},
+        "tags": ["a"],
+        "raw": "hi",
+        "at": "2024-01-02T03:04:05+00:00",
+        "id": str(task_id),
+    }
+
+
+def test_parse_datetime_accepts_zulu_suffix_and_rejects_garbage():
+    """parse_datetime handles ISO strings with Z and returns None for invalid input."""
+    parsed = parse_datetime("2024-01-02T03:04:05Z")
+    assert parsed == datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    assert parse_datetime("not a date") is None
+    assert parse_datetime(parsed) is parsed
+
+
+def test_aggregate_llm_usage_sums_stages_and_models() -> None:
+    totals = aggregate_llm_usage(
+        [
+            {
+                "total_tokens_in": 10,
+                "total_tokens_out": 5,
+                "by_stage": {"coding": {"tokens_in": 10, "tokens_out": 5, "total_tokens": 15, "models": {"gpt": 1}}},
+                "models": {"gpt": 1},
+            },
+            {
+                "total_tokens_in": 2,
+                "total_tokens_out": None,
+                "by_stage": {"coding": {"tokens_in": 2, "models": {"gpt": 2, "mock": 1}}},
+                "models": {"gpt": 2, "mock": 1},
+            },
+            "ignored",
+        ]
+    )
+
+    assert totals == {
+        "total_tokens_in": 12,
+        "total_tokens_out": 5,
+        "total_tokens": 17,
+        "by_stage": {
+            "coding": {"tokens_in": 12, "tokens_out": 5, "total_tokens": 15, "models": {"gpt": 3, "mock": 1}}
+        },
+        "models": {"gpt": 3, "mock": 1},
+    }
+    assert type(totals["models"]) is dict
@@ -0,0 +1,80 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app import db, main
+from app.main import ensure_task_access, hash_api_key, task_access_allowed
+
+
+@pytest.fixture
+def db_task(monkeypatch):
+    lookups = []
+
+    async def fake_get_task_row(task_id):
+        lookups.append(task_id)
+        if task_id != "task":
+            return None
+        return {"id": task_id, "owner_user_id": None, "owner_key_hash": "owner-hash"}
+
+    async def fake_auth_context(request):
+        return SimpleNamespace(user=None, principal="api_key", owner_key_hash=request)
+
+    monkeypatch.setattr(db, "is_enabled", lambda: True)
+    monkeypatch.setattr(db, "get_task_row", fake_get_task_row)
+    monkeypatch.setattr(main, "get_auth_context", fake_auth_context)
+    monkeypatch.setattr(main, "_task_owner_cache", main.ContainerCache(maxsize=2))
+    return lookups
+
+
+@pytest.mark.asyncio
+async def test_task_access_reuses_cached_owner(db_task) -> None:
+    await ensure_task_access("task", "owner-hash")
+    await ensure_task_access("task", "owner-hash")
+
+    with pytest.raises(HTTPException) as forbidden:
+        await ensure_task_access("task", "other-hash")
+
+    assert forbidden.value.status_code == 403
+    assert db_task == ["task"]
+
+
+@pytest.mark.asyncio
+async def test_task_access_does_not_cache_missing_tasks(db_task) -> None:
+    for _ in range(2):
+        with pytest.raises(HTTPException) as missing:
+            await ensure_task_access("absent", "owner-hash")
+        assert missing.value.status_code == 404
+
+    assert db_task == ["absent", "absent"]
+
+
+@pytest.mark.asyncio
+async def test_task_access_cache_evicts_least_recent_owner(db_task, monkeypatch) -> None:
+    async def fake_get_task_row(task_id):
+        db_task.append(task_id)
+        return {"id": task_id, "owner_user_id": None, "owner_key_hash": "owner-hash"}
+
+    monkeypatch.setattr(db, "get_task_row", fake_get_task_row)
+    for task_id in ["a", "b", "a", "c"]:
+        await ensure_task_access(task_id, "owner-hash")
+
+    assert list(main._task_owner_cache) == ["a", "c"]
+    assert db_task == ["a", "b", "c"]
+
+
+def test_task_access_allowed_compares_key_hashes() -> None:
+    task = {"owner_user_id": None, "owner_key_hash": hash_api_key("secret")}
+
+    assert task_access_allowed(
+        task, principal="api_key", owner_key_hash=hash_api_key("secret"), owner_user_id=None
+    )
+    assert not task_access_allowed(
+        task, principal="api_key", owner_key_hash=hash_api_key("other"), owner_user_id=None
+    )
+    assert not task_access_allowed(
+        {"owner_user_id": None, "owner_key_hash": None},
+        principal="api_key",
+        owner_key_hash=hash_api_key("secret"),
+        owner_user_id=None,
+    )